@@ -0,0 +1,80 @@
+"""asynchronous.py
+
+Non-blocking version checks and migrations for many databases.
+
+An `AsyncDatabaseMigrator` wraps a DatabaseMigrator and runs each
+request on a small shared pool of worker threads, handing back an
+AsyncResult immediately::
+
+  migrator = AsyncDatabaseMigrator(core.getMigrator("migrations/"))
+  versions = [migrator.getVersion(dsn) for dsn in dsns]
+  pending = [dsn for dsn, version in zip(dsns, versions)
+             if version.get() < len(migrator.migrations)]
+  for result in [migrator.migrate(dsn) for dsn in pending]:
+      result.get()
+
+A control loop can keep hundreds of requests in flight while only the
+pool's threads ever block on a database, and every request shares the
+migrations parsed by the wrapped migrator.  Each request uses its own
+connection, which is closed when the request is done.
+
+"""
+import copy
+import threading
+from multiprocessing.pool import ThreadPool
+
+from goose import fleet
+
+
+DEFAULT_WORKERS = 8
+
+_pool = None
+_poolLock = threading.Lock()
+
+
+def sharedPool(workers=DEFAULT_WORKERS):
+    """The pool used by migrators that aren't given their own.
+
+    ``workers`` only matters for the call that creates the pool.
+    """
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = ThreadPool(workers)
+        return _pool
+
+
+class AsyncDatabaseMigrator(object):
+    def __init__(self, migrator, pool=None):
+        self.migrator = migrator
+        self.migrations = migrator.migrations
+        self.pool = pool if pool is not None else sharedPool()
+        self.statements = fleet.SharedStatements(migrator)
+
+    def targetMigrator(self, dsn):
+        target = copy.copy(self.migrator)
+        target.statements = self.statements
+        target.checksum = self.statements.checksum
+        target.verbose = False
+        target.connect(dsn, echo=False)
+        return target
+
+    def call(self, dsn, method, *args):
+        target = self.targetMigrator(dsn)
+        try:
+            return getattr(target, method)(*args)
+        finally:
+            target.close()
+
+    def getVersion(self, dsn, callback=None):
+        """Returns an AsyncResult for the version of ``dsn``.
+        """
+        return self.pool.apply_async(self.call, (dsn, "getVersion"),
+                                     callback=callback)
+
+    def migrate(self, dsn, fromVersion=None, toVersion=None, callback=None):
+        """Returns an AsyncResult for the list of migrations applied to ``dsn``.
+        """
+        return self.pool.apply_async(self.call,
+                                     (dsn, "migrate", fromVersion, toVersion),
+                                     callback=callback)
@@ -0,0 +1,194 @@
+"""backup.py
+
+Snapshots a database before it's migrated, and puts it back.
+
+``migrate --backup`` takes a backup with the database's own tools
+before applying anything, and ``restore`` puts it back after a failed
+run::
+
+  goose -d postgresql://db/app -m migrations/ migrate --backup
+  goose -d postgresql://db/app restore app-20120301120000.dump
+
+SQLite databases are copied with the online backup API through the
+sqlite3 shell's ``.backup`` command, which only ever holds a lock for
+a moment, or by copying the file under a write lock when the shell
+isn't installed.  PostgreSQL databases are dumped by ``pg_dump`` in
+its compressed directory format using several jobs and restored, in
+parallel as well, by ``pg_restore``.  MySQL databases are dumped with
+``mysqldump --single-transaction``.  The tools write the backup
+straight to disk; nothing passes through goose.
+
+A restore drops and recreates the whole database before loading the
+backup, so tables and anything else made by migrations that ran after
+the backup are gone too, just like their rows in migration_info.
+
+"""
+import distutils.spawn
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+
+from goose import models
+from goose import render
+
+
+COPY_BUFFER = 1024 * 1024
+COMPRESSION = 6
+
+
+def defaultJobs():
+    try:
+        return min(4, multiprocessing.cpu_count())
+    except NotImplementedError:
+        return 1
+
+
+def sqliteDatabase(url):
+    if not url.database or url.database == ":memory:":
+        raise ValueError("An in-memory sqlite database can't be backed up")
+    return url.database
+
+
+def defaultBackupPath(dsn):
+    """Where a backup of ``dsn`` goes unless it's given a path."""
+    from sqlalchemy.engine.url import make_url
+    url = make_url(dsn)
+    stamp = time.strftime("%Y%m%d%H%M%S")
+    if render.dialectName(dsn) == "sqlite":
+        return "%s.%s.backup"%(sqliteDatabase(url), stamp)
+    return "%s-%s.dump"%(url.database, stamp)
+
+
+def shellPath(path):
+    """Quotes ``path`` as an argument to a sqlite3 shell dot command."""
+    return '"%s"'%(path.replace("\\", "\\\\").replace('"', '\\"'),)
+
+
+def dumpCommand(dsn, path, jobs=None):
+    """The command line and environment that back ``dsn`` up to ``path``.
+    """
+    from sqlalchemy.engine.url import make_url
+    url = make_url(dsn)
+    dialect = render.dialectName(dsn)
+    if dialect == "sqlite":
+        return (["sqlite3", sqliteDatabase(url), ".backup %s"%(shellPath(path),)],
+                dict(os.environ))
+    arguments, environment = render.connectionArguments(url, dialect)
+    if dialect == "postgresql":
+        return (["pg_dump", "--format=directory", "--jobs=%s"%(jobs or defaultJobs(),),
+                 "--compress=%s"%(COMPRESSION,), "--file=%s"%(path,)] +
+                arguments + [url.database]), environment
+    return (["mysqldump", "--single-transaction", "--quick", "--routines",
+             "--result-file=%s"%(path,)] + arguments + [url.database]), environment
+
+
+def restoreCommands(dsn, path, jobs=None):
+    """
+    The commands that restore ``dsn`` from ``path``, in order, as
+    (command line, environment, file to feed its stdin or None).
+    """
+    from sqlalchemy.engine.url import make_url
+    url = make_url(dsn)
+    dialect = render.dialectName(dsn)
+    if dialect == "sqlite":
+        # .restore replaces every page of the database
+        return [(["sqlite3", sqliteDatabase(url), ".restore %s"%(shellPath(path),)],
+                 dict(os.environ), None)]
+    arguments, environment = render.connectionArguments(url, dialect)
+    if dialect == "postgresql":
+        # with --create, --clean drops the database itself and
+        # pg_restore only uses --dbname to connect before recreating it
+        return [(["pg_restore", "--clean", "--if-exists", "--create",
+                  "--jobs=%s"%(jobs or defaultJobs(),)] + arguments +
+                 ["--dbname=postgres", path], environment, None)]
+    name = "`%s`"%(url.database.replace("`", "``"),)
+    return [(["mysql", "--batch"] + arguments +
+             ["--execute=DROP DATABASE IF EXISTS %s; CREATE DATABASE %s"%(
+                    name, name)], environment, None),
+            (["mysql", "--batch"] + arguments + [url.database], environment, path)]
+
+
+def run(command, environment, inputPath=None):
+    stdin = None
+    if inputPath is not None:
+        stdin = open(inputPath, "rb")
+    try:
+        try:
+            process = subprocess.Popen(command, stdin=stdin, env=environment)
+        except OSError, e:
+            raise ValueError("Unable to run %s: %s"%(command[0], e))
+        returncode = process.wait()
+    finally:
+        if stdin is not None:
+            stdin.close()
+    if returncode != 0:
+        raise ValueError("%s exited with status %s"%(command[0], returncode))
+
+
+def copySqlite(source, target):
+    """
+    Copies the sqlite database ``source`` to ``target`` while holding a
+    write lock on it, for when the sqlite3 shell isn't available.
+    """
+    import sqlite3
+    connection = sqlite3.connect(source, isolation_level=None)
+    try:
+        # fold any write-ahead log into the file before copying it
+        connection.execute("PRAGMA wal_checkpoint")
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            with open(source, "rb") as f:
+                with open(target, "wb") as out:
+                    shutil.copyfileobj(f, out, COPY_BUFFER)
+        finally:
+            connection.execute("ROLLBACK")
+    finally:
+        connection.close()
+
+
+def restoreSqlite(backupPath, database):
+    """Puts a copied sqlite database back in place of ``database``."""
+    restoring = database + ".restoring"
+    with open(backupPath, "rb") as f:
+        with open(restoring, "wb") as out:
+            shutil.copyfileobj(f, out, COPY_BUFFER)
+    os.rename(restoring, database)
+    for suffix in ("-wal", "-shm", "-journal"):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+
+
+def hasShell(dsn):
+    return (render.dialectName(dsn) != "sqlite" or
+            distutils.spawn.find_executable("sqlite3") is not None)
+
+
+def backupDatabase(dsn, path=None, jobs=None):
+    """Backs ``dsn`` up to ``path`` and returns the path.
+    """
+    if path is None:
+        path = defaultBackupPath(dsn)
+    if hasShell(dsn):
+        command, environment = dumpCommand(dsn, path, jobs)
+        run(command, environment)
+    else:
+        from sqlalchemy.engine.url import make_url
+        copySqlite(sqliteDatabase(make_url(dsn)), path)
+    return path
+
+
+def restoreDatabase(dsn, path, jobs=None):
+    """Restores ``dsn`` from a backup made by `backupDatabase`.
+    """
+    if not os.path.exists(path):
+        raise ValueError("There's no backup at %s"%(path,))
+    # the database can't be dropped while goose is connected to it
+    models.engines.dispose(dsn)
+    if hasShell(dsn):
+        for command, environment, inputPath in restoreCommands(dsn, path, jobs):
+            run(command, environment, inputPath)
+    else:
+        from sqlalchemy.engine.url import make_url
+        restoreSqlite(path, sqliteDatabase(make_url(dsn)))
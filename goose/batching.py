@@ -0,0 +1,131 @@
+"""batching.py
+
+Coalesces runs of single row INSERT statements into multi-row INSERTs.
+
+Seed data migrations are often thousands of statements like::
+
+  INSERT INTO country (code, name) VALUES ('NZ', 'New Zealand');
+
+Executing each one costs a round trip to the database.  `batchInserts`
+sits between the tokenizer and the cursor and rewrites consecutive
+INSERTs into the same table with the same column list as::
+
+  INSERT INTO country (code, name) VALUES ('NZ', 'New Zealand'),
+  ('AU', 'Australia'), ...
+
+Anything it doesn't fully understand (INSERT ... SELECT, ON CONFLICT,
+RETURNING, backslash escapes) is passed through untouched.
+
+"""
+import re
+
+from goose import tokenizer
+
+
+INSERT = re.compile(r"\s*insert\s+into\s+([^\s(]+)\s*(\([^)]*\))?\s*values\s*(?=\()",
+                    re.IGNORECASE)
+ROW_TOKEN = re.compile(r"'(?:[^']|'')*'|\"[^\"]*\"|`[^`]*`|[()]")
+QUOTED_IDENTIFIER = re.compile(r"\"[^\"]*\"|`[^`]*`|\[[^\]]*\]")
+
+
+def foldCase(text):
+    """Lower-cases ``text`` except for quoted identifiers, whose case
+    matters: "Foo" and "foo" are different tables.
+    """
+    parts = []
+    position = 0
+    for match in QUOTED_IDENTIFIER.finditer(text):
+        parts.append(text[position:match.start()].lower())
+        parts.append(match.group())
+        position = match.end()
+    parts.append(text[position:].lower())
+    return "".join(parts)
+
+
+def splitRows(values):
+    """Returns the row tuples in the VALUES part of an INSERT.
+
+    Returns None unless ``values`` is nothing but parenthesised rows
+    separated by commas.
+    """
+    if "\\" in values:
+        # MySQL style backslash escapes would throw off the quote
+        # matching below.
+        return None
+    rows = []
+    depth = 0
+    start = end = 0
+    for match in ROW_TOKEN.finditer(values):
+        token = match.group()
+        if token == "(":
+            if depth == 0:
+                if values[end:match.start()].strip() != ("," if rows else ""):
+                    return None
+                start = match.start()
+            depth += 1
+        elif token == ")":
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                end = match.end()
+                rows.append(values[start:end])
+    if depth or not rows or values[end:].strip():
+        return None
+    return rows
+
+
+def parseInsert(statement):
+    """Returns ``(key, header, rows)`` for a batchable INSERT or None.
+
+    Statements with equal keys can be merged by joining their rows
+    after a single header.
+    """
+    match = INSERT.match(statement)
+    if match is None:
+        return None
+    rows = splitRows(statement[match.end():])
+    if rows is None:
+        return None
+    table, columns = match.groups()
+    key = (foldCase(table), " ".join(foldCase(columns or "").split()))
+    return key, statement[:match.end()].strip(), rows
+
+
+def batchInserts(statements, batchSize):
+    """Yield ``statements`` with consecutive compatible INSERTs merged.
+
+    At most ``batchSize`` rows are combined into a single statement.
+    """
+    batch = []  # the statements being merged
+    key = header = None
+    rows = []
+
+    for statement in statements:
+        insert = None
+        if not getattr(statement, "directives", None):
+            insert = parseInsert(statement)
+        if insert is not None and insert[0] == key and \
+                len(rows) + len(insert[2]) <= batchSize:
+            batch.append(statement)
+            rows.extend(insert[2])
+            continue
+        for merged in mergeBatch(batch, header, rows):
+            yield merged
+        batch, key, header, rows = [], None, None, []
+        if insert is None:
+            yield statement
+            continue
+        batch.append(statement)
+        key, header, rows = insert
+
+    for merged in mergeBatch(batch, header, rows):
+        yield merged
+
+
+def mergeBatch(batch, header, rows):
+    if len(batch) == 1:
+        yield batch[0]
+    elif batch:
+        yield tokenizer.Statement("%s %s" % (header, ",\n".join(rows)),
+                                  getattr(batch[0], "offset", 0))
@@ -0,0 +1,95 @@
+"""Synthetic migration directories for the benchmarks.
+
+Every corpus is generated deterministically from its size so runs on
+different machines and different days measure the same work.  Each
+function writes an index.yaml plus its migrations into ``directory``
+and returns the number of statements written.
+
+"""
+import os
+
+
+def writeIndex(directory, migrations):
+    with open(os.path.join(directory, "index.yaml"), "w") as f:
+        f.write("migrations:\n")
+        for migration in migrations:
+            f.write("  - %s\n"%(migration,))
+
+
+def manySmallFiles(directory, files=2000):
+    """Lots of short schema migrations: one table and an index each."""
+    migrations = []
+    for i in xrange(files):
+        name = "%05d_table_%d.sql"%(i, i)
+        with open(os.path.join(directory, name), "w") as f:
+            f.write("-- migration %d\n"
+                    "CREATE TABLE t%d (id INT PRIMARY KEY, name VARCHAR(64));\n"
+                    "CREATE INDEX t%d_name ON t%d (name);\n"
+                    "INSERT INTO t%d (id, name) VALUES (1, 'first; row');\n"
+                    %(i, i, i, i, i))
+        migrations.append(name)
+    writeIndex(directory, migrations)
+    return files * 3
+
+
+def giantDataLoad(directory, rows=200000):
+    """One seed data file of single row INSERTs."""
+    name = "seed.sql"
+    with open(os.path.join(directory, name), "w") as f:
+        f.write("CREATE TABLE seed (id INT, name VARCHAR(64), note TEXT);\n")
+        for i in xrange(rows):
+            f.write("INSERT INTO seed (id, name, note) VALUES "
+                    "(%d, 'name %d', 'it''s row %d; 10%% done');\n"%(i, i, i))
+            if i % 1000 == 0:
+                f.write("-- checkpoint %d\n"%(i,))
+    writeIndex(directory, [name])
+    return rows + 1
+
+
+def procedures(directory, files=50, perFile=20):
+    """MySQL style files full of DELIMITER bracketed stored procedures."""
+    migrations = []
+    for i in xrange(files):
+        name = "%03d_procedures.sql"%(i,)
+        with open(os.path.join(directory, name), "w") as f:
+            for j in xrange(perFile):
+                f.write("DROP PROCEDURE IF EXISTS p%d_%d;\n"
+                        "DELIMITER $$\n"
+                        "CREATE PROCEDURE p%d_%d(IN x INT)\n"
+                        "BEGIN\n"
+                        "  /* keep a running total; of sorts */\n"
+                        "  DECLARE total INT DEFAULT 0;\n"
+                        "  SET total = total + x;\n"
+                        "  SELECT 'done; really' AS status, total;\n"
+                        "END$$\n"
+                        "DELIMITER ;\n"%(i, j, i, j))
+        migrations.append(name)
+    writeIndex(directory, migrations)
+    return files * perFile * 2
+
+
+def hugeIndex(directory, entries=10000):
+    """An index with many entries, each a one statement migration."""
+    migrations = []
+    for i in xrange(entries):
+        name = "%05d.sql"%(i,)
+        with open(os.path.join(directory, name), "w") as f:
+            f.write("SELECT %d;\n"%(i,))
+        migrations.append(name)
+    writeIndex(directory, migrations)
+    return entries
+
+
+CORPORA = {
+    "small-files": (manySmallFiles, 2000),
+    "giant-load": (giantDataLoad, 200000),
+    "procedures": (procedures, 50),
+    "huge-index": (hugeIndex, 10000),
+}
+
+
+def build(name, directory, scale=1.0):
+    """Writes the corpus called ``name``, with its size multiplied by scale.
+    """
+    function, size = CORPORA[name]
+    return function(directory, max(1, int(size * scale)))
@@ -0,0 +1,64 @@
+"""Peak memory of streaming a migration file through executeBatch.
+
+Each size runs in a fresh interpreter so ru_maxrss only reflects that
+run.  Run with::
+
+  python -m goose.bench.memory [MEGABYTES ...]
+
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from goose import core
+
+
+class NullCursor(object):
+    def execute(self, statement):
+        pass
+
+
+def writeScript(path, megabytes):
+    row = "INSERT INTO seed (id, note) VALUES (%d, 'padding padding padding');\n"
+    with open(path, "w") as f:
+        written, i = 0, 0
+        while written < megabytes * 1024 * 1024:
+            line = row % (i,)
+            f.write(line)
+            written += len(line)
+            i += 1
+
+
+def peakKilobytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(path):
+    before = peakKilobytes()
+    with open(path, "r") as sqlFile:
+        core.executeBatch(NullCursor(), sqlFile)
+    print before, peakKilobytes()
+
+
+def main(args):
+    if args and args[0] == "--child":
+        return child(args[1])
+    sizes = [int(arg) for arg in args] or [10, 100]
+    for megabytes in sizes:
+        handle, path = tempfile.mkstemp(suffix=".sql")
+        os.close(handle)
+        try:
+            writeScript(path, megabytes)
+            output = subprocess.check_output(
+                [sys.executable, "-m", "goose.bench.memory", "--child", path])
+            before, after = [int(x) for x in output.split()]
+            print "%6d MB script: peak RSS %7d KB (+%d KB while executing)" % (
+                megabytes, after, after - before)
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
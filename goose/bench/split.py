@@ -0,0 +1,71 @@
+"""Statement splitting throughput: goose.tokenizer vs. the old regexes.
+
+Run with::
+
+  python -m goose.bench.split [STATEMENTS]
+
+"""
+import re
+import sys
+import time
+
+from goose import tokenizer
+
+
+def regexSplit(sql,
+               regex=r"(?mx) ([^';]* (?:'[^']*'[^';]*)*)",
+               comment_regex=r"(?mx) (?:^\s*$)|(?:--.*$)"):
+    """The comment stripping and splitting executeBatch used to do.
+    """
+    sql = "\n".join([x.strip().replace("%", "%%") for x in re.split(comment_regex, sql) if x.strip()])
+    in_proc = False
+    statements = []
+    for st in re.split(regex, sql)[1:][::2]:
+        if st.strip().lower().startswith("delimiter"):
+            in_proc = not in_proc
+            if statements and not in_proc:
+                yield ";".join(statements)
+                statements = []
+            continue
+        if in_proc:
+            statements.append(st)
+        else:
+            yield st
+
+
+def tokenizerSplit(sql):
+    for statement in tokenizer.iterStatements(sql):
+        yield statement.replace("%", "%%")
+
+
+def makeScript(statements):
+    lines = ["-- synthetic seed data",
+             "CREATE TABLE seed (id INT, name VARCHAR(64), note TEXT);"]
+    for i in xrange(statements):
+        lines.append("INSERT INTO seed (id, name, note) VALUES "
+                     "(%d, 'name %d', 'it''s row %d; 10%% done');" % (i, i, i))
+        if i % 100 == 0:
+            lines.append("-- checkpoint %d" % (i,))
+    return "\n".join(lines) + "\n"
+
+
+def measure(split, sql):
+    start = time.time()
+    count = 0
+    for statement in split(sql):
+        count += 1
+    return count, time.time() - start
+
+
+def main(args):
+    statements = int(args[0]) if args else 100000
+    sql = makeScript(statements)
+    print "script: %d statements, %.1f MB" % (statements, len(sql) / 1e6)
+    for name, split in (("regex", regexSplit), ("tokenizer", tokenizerSplit)):
+        count, elapsed = measure(split, sql)
+        print "%-10s %8d statements %8.3fs %10.0f statements/s %7.1f MB/s" % (
+            name, count, elapsed, count / elapsed, len(sql) / elapsed / 1e6)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,208 @@
+"""The goose benchmark suite.
+
+Measures, against the synthetic corpora in `goose.bench.corpus`:
+
+parse
+    statements per second split out of every migration by the tokenizer.
+execute
+    statements per second applied to a SQLite file database by a full
+    ``DatabaseMigrator.migrate`` run, including the migration_info
+    bookkeeping for each migration.
+execute-batched
+    the same with INSERT batching (``--batch-inserts 500``).
+startup-cold, startup-warm
+    seconds to import goose.core and load the index, without and with
+    the index cache.
+
+Every measurement runs in a fresh interpreter so that imports are
+paid for honestly and the peak RSS reported is that benchmark's own.
+The fastest of ``--repeat`` runs is kept.  Results are written as
+JSON for trend tracking::
+
+  python -m goose.bench.suite -o results.json
+  python -m goose.bench.suite --scale 0.1 --only parse
+
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from goose.bench import corpus
+
+
+BENCHMARKS = [
+    ("parse", "small-files"),
+    ("parse", "giant-load"),
+    ("parse", "procedures"),
+    ("parse", "huge-index"),
+    ("execute", "small-files"),
+    ("execute", "giant-load"),
+    ("execute", "huge-index"),
+    ("execute-batched", "giant-load"),
+    ("startup-cold", "huge-index"),
+    ("startup-warm", "huge-index"),
+]
+
+
+def peakKilobytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def parse(directory, workDirectory):
+    from goose import core
+    migrator = core.getMigrator(directory)
+    start = time.time()
+    count = 0
+    for migration in migrator.migrations:
+        for statement in migrator.statements(migration):
+            count += 1
+    return {"statements": count, "seconds": time.time() - start}
+
+
+def execute(directory, workDirectory, batchSize=None):
+    from goose import core
+    from goose import models
+    dsn = "sqlite:///%s"%(os.path.join(workDirectory, "bench.db"),)
+    migrator = core.getMigrator(directory)
+    migrator.verbose = False
+    migrator.batchSize = batchSize
+    migrator.connect(dsn)
+    models.init(migrator.engine)
+    start = time.time()
+    applied = migrator.migrate()
+    elapsed = time.time() - start
+    # after batching, so fewer than the statements in the corpus
+    executed = migrator.session.query(
+        models.func.sum(models.Migration.statementCount)).scalar()
+    return {"executed": executed, "migrations": len(applied),
+            "seconds": elapsed}
+
+
+def executeBatched(directory, workDirectory):
+    return execute(directory, workDirectory, batchSize=500)
+
+
+def startup(directory, workDirectory):
+    start = time.time()
+    from goose import core
+    migrator = core.getMigrator(directory)
+    return {"migrations": len(migrator.migrations),
+            "seconds": time.time() - start}
+
+
+RUNNERS = {
+    "parse": parse,
+    "execute": execute,
+    "execute-batched": executeBatched,
+    "startup-cold": startup,
+    "startup-warm": startup,
+}
+
+
+def child(benchmark, directory, workDirectory):
+    result = RUNNERS[benchmark](directory, workDirectory)
+    result["peakRssKb"] = peakKilobytes()
+    print json.dumps(result)
+
+
+def runOnce(benchmark, directory, cacheDirectory):
+    workDirectory = tempfile.mkdtemp(prefix="goose-bench-")
+    try:
+        environment = dict(os.environ, GOOSE_CACHE_DIR=cacheDirectory)
+        if benchmark == "startup-cold":
+            environment["GOOSE_CACHE_DIR"] = os.path.join(workDirectory,
+                                                          "cache")
+        output = subprocess.check_output(
+            [sys.executable, "-m", "goose.bench.suite", "--child", benchmark,
+             directory, workDirectory], env=environment)
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workDirectory)
+
+
+def run(benchmark, directory, cacheDirectory, repeat, statements):
+    if benchmark == "startup-warm":
+        # fill the cache
+        runOnce(benchmark, directory, cacheDirectory)
+    results = [runOnce(benchmark, directory, cacheDirectory)
+               for attempt in range(repeat)]
+    best = min(results, key=lambda result: result["seconds"])
+    best["peakRssKb"] = max(result["peakRssKb"] for result in results)
+    if benchmark.startswith("execute"):
+        best["statements"] = statements
+    if "statements" in best and best["seconds"] > 0:
+        best["statementsPerSecond"] = best["statements"] / best["seconds"]
+    if "migrations" in best and best["seconds"] > 0:
+        best["migrationsPerSecond"] = best["migrations"] / best["seconds"]
+    return best
+
+
+def runSuite(scale=1.0, repeat=3, only=None, log=sys.stderr):
+    """Runs the benchmarks and returns the report as a dict.
+    """
+    from goose import core
+    root = tempfile.mkdtemp(prefix="goose-bench-")
+    results = []
+    try:
+        cacheDirectory = os.path.join(root, "cache")
+        sizes = {}
+        for benchmark, name in BENCHMARKS:
+            if only and benchmark not in only and name not in only:
+                continue
+            directory = os.path.join(root, name)
+            if name not in sizes:
+                os.mkdir(directory)
+                sizes[name] = corpus.build(name, directory, scale)
+            result = run(benchmark, directory, cacheDirectory, repeat,
+                         sizes[name])
+            result.update({"benchmark": benchmark, "corpus": name})
+            results.append(result)
+            if log is not None:
+                log.write("%-16s %-12s %9.3fs %10s statements/s %8d KB\n"%(
+                        benchmark, name, result["seconds"],
+                        "%.0f"%(result["statementsPerSecond"],)
+                        if "statementsPerSecond" in result else "-",
+                        result["peakRssKb"]))
+    finally:
+        shutil.rmtree(root)
+    return {"goose": core.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "scale": scale,
+            "repeat": repeat,
+            "results": results}
+
+
+def main(args):
+    if args and args[0] == "--child":
+        return child(*args[1:])
+    parser = argparse.ArgumentParser(
+        prog="python -m goose.bench.suite",
+        description="goose benchmark suite")
+    parser.add_argument("-o", "--output", dest="output", metavar="FILE",
+                        help="write the JSON report here instead of stdout")
+    parser.add_argument("--scale", dest="scale", type=float, default=1.0,
+                        help="multiply the size of every corpus (default: 1.0)")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3,
+                        help="runs per benchmark, the fastest is kept (default: 3)")
+    parser.add_argument("--only", dest="only", nargs="*",
+                        help="only run these benchmarks or corpora")
+    options = parser.parse_args(args)
+    report = runSuite(options.scale, options.repeat, options.only)
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(report, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,147 @@
+"""bundle.py
+
+Precompiled migration bundles.
+
+``goose compile`` reads the index and every migration once and writes
+a single file that deploy hosts can migrate from directly::
+
+  goose -m migrations/ compile -o release.goose
+  goose -m release.goose -d sqlite:///my.db migrate
+
+A bundle is a header line and a JSON manifest line::
+
+  GOOSE-BUNDLE 1
+  {"index": {...}, "migrations": [{"name": "create.sql", "sha1": ...,
+   "offset": 0, "length": 120, "statements": 2}, ...]}
+
+followed by one block per migration.  A block is a JSON list of
+``[length, offset]`` pairs, one per statement, on a line of its own
+(statements with goose directives get a third element, their
+directives),
+followed by the text of the statements, already split and with their
+comments removed.  ``offset`` is where the statement started in the
+original file.  Block offsets in the manifest are relative to the end
+of the manifest line, so a migrator only reads the manifest and the
+blocks of the migrations it actually applies.
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from goose import core
+from goose import pymigration
+from goose import tokenizer
+
+
+MAGIC = "GOOSE-BUNDLE 1\n"
+
+
+class HashingReader(object):
+    """File wrapper that feeds everything read through a hash."""
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
+
+
+def writeBlock(body, migrationPath):
+    """Appends the block for one migration file to ``body``.
+
+    A Python migration is stored as a single "statement" holding its
+    source.  Returns the manifest entry for the block.
+    """
+    digest = hashlib.sha1()
+    table = []
+    offset = body.tell()
+    with tempfile.TemporaryFile() as texts:
+        with open(migrationPath, "r") as sqlFile:
+            if pymigration.isPythonMigration(migrationPath):
+                source = HashingReader(sqlFile, digest).read()
+                statements = [tokenizer.Statement(source, 0)]
+            else:
+                statements = tokenizer.iterStatements(
+                    HashingReader(sqlFile, digest))
+            for statement in statements:
+                texts.write(statement)
+                entry = [len(statement), statement.offset]
+                if statement.directives:
+                    entry.append(statement.directives)
+                table.append(entry)
+        body.write(json.dumps(table, separators=(",", ":")))
+        body.write("\n")
+        texts.seek(0)
+        shutil.copyfileobj(texts, body)
+    return {"sha1": digest.hexdigest(),
+            "offset": offset,
+            "length": body.tell() - offset,
+            "statements": len(table)}
+
+
+def compileBundle(migrator, bundlePath):
+    """Writes every migration known to ``migrator`` to a bundle.
+    """
+    entries = []
+    with tempfile.TemporaryFile() as body:
+        for migration in migrator.availableMigrations():
+            entry = writeBlock(body, os.path.join(migrator.migrationDirectory,
+                                                  migration))
+            entry["name"] = migration
+            entries.append(entry)
+        manifest = {"index": migrator.flatIndex(), "migrations": entries}
+        # write next to the destination and rename so a half written
+        # bundle is never picked up by a deploy
+        partialPath = bundlePath + ".partial"
+        with open(partialPath, "wb") as bundle:
+            bundle.write(MAGIC)
+            bundle.write(json.dumps(manifest, separators=(",", ":")))
+            bundle.write("\n")
+            body.seek(0)
+            shutil.copyfileobj(body, bundle)
+        os.rename(partialPath, bundlePath)
+    return entries
+
+
+class BundleMigrator(core.DatabaseMigrator):
+    """A DatabaseMigrator that runs migrations from a compiled bundle.
+    """
+
+    def __init__(self, bundlePath):
+        self.bundlePath = bundlePath
+        with open(bundlePath, "rb") as bundle:
+            if bundle.readline() != MAGIC:
+                raise ValueError("%s is not a goose bundle"%(bundlePath,))
+            manifest = json.loads(bundle.readline())
+            self.bodyOffset = bundle.tell()
+        self.entries = dict((str(entry["name"]), entry)
+                            for entry in manifest["migrations"])
+        core.DatabaseMigrator.__init__(self, bundlePath,
+                                       index=manifest["index"])
+
+    def checkMigrations(self):
+        for migration in self.requiredMigrations():
+            if migration not in self.entries:
+                raise ValueError("Missing Migration File: %s"%(migration,))
+
+    def checksum(self, migrationName):
+        return self.entries[migrationName]["sha1"]
+
+    def pythonSource(self, migrationName):
+        return "".join(self.statements(migrationName))
+
+    def migrationSize(self, migrationName):
+        return self.entries[migrationName]["length"]
+
+    def statements(self, migrationName):
+        entry = self.entries[migrationName]
+        with open(self.bundlePath, "rb") as bundle:
+            bundle.seek(self.bodyOffset + entry["offset"])
+            table = json.loads(bundle.readline())
+            for entry in table:
+                yield tokenizer.Statement(bundle.read(entry[0]), *entry[1:])
@@ -0,0 +1,147 @@
+"""chunking.py
+
+Runs a huge UPDATE or DELETE as a series of small ones.
+
+A statement preceded by a chunk directive::
+
+  -- goose:chunk key=id size=10000 sleep=0.5
+  UPDATE orders SET total = subtotal + tax WHERE total IS NULL;
+
+is executed once for every ``size`` wide range of ``key``, from the
+smallest key in the table to the largest one when the statement
+starts::
+
+  UPDATE orders SET total = subtotal + tax
+  WHERE (id >= 1 AND id < 10001) AND (total IS NULL)
+
+with a commit after each range and ``sleep`` seconds between them, so
+no single transaction holds locks on the whole table.  ``key`` must be
+an integer column, ideally the primary key, and the table is taken
+from the statement unless ``table=`` says otherwise.  Statements that
+bring in other tables (``UPDATE ... FROM``, ``DELETE ... USING``,
+joins) are refused, since the key could belong to any of them.
+
+Because every range is committed as it's done, a chunked statement
+also commits the statements before it in the same migration.  The
+migration is recorded once it has finished as usual.
+
+"""
+import re
+import time
+
+
+DEFAULT_SIZE = 10000
+
+TARGET = re.compile(r"(?is)^\s*(?:update|delete\s+from)\s+([\w.\"`\[\]]+)")
+# quoted text, block comments, parentheses and the keywords that
+# matter at the top level
+TOKEN = re.compile(r"""(?is)'[^']*'|"[^"]*"|`[^`]*`|/\*.*?\*/|[()]|"""
+                   r"""\b(where|returning|order\s+by|limit|from|using|join)\b""")
+
+
+def topLevelKeywords(text):
+    """
+    Yields (keyword, match) for keywords outside quotes, comments and
+    parentheses.
+    """
+    depth = 0
+    for match in TOKEN.finditer(text):
+        token = match.group()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif match.group(1) and depth == 0:
+            yield match.group(1).lower().split()[0], match
+
+
+def chunkOptions(options):
+    """Checks and converts the options of a chunk directive.
+    """
+    if "key" not in options:
+        raise ValueError("goose:chunk needs a key, e.g. key=id")
+    try:
+        size = int(options.get("size", DEFAULT_SIZE))
+        sleep = float(options.get("sleep", 0))
+    except ValueError:
+        raise ValueError("goose:chunk size must be an integer and sleep a"
+                         " number of seconds: %r"%(options,))
+    if size < 1:
+        raise ValueError("goose:chunk size must be positive")
+    return {"key": options["key"], "size": size, "sleep": sleep,
+            "table": options.get("table")}
+
+
+def chunkTemplate(statement, key):
+    """Returns a function of (low, high) giving the statement restricted
+    to ``low <= key < high``.
+    """
+    text = statement.strip()
+    # the FROM of DELETE FROM is the statement's own
+    target = TARGET.match(text)
+    offset = target.end() if target is not None else 0
+    if text[offset:].lstrip().startswith(","):
+        raise ValueError("Chunked statements can only change one table: %s"%(text,))
+    match = None
+    for keyword, found in topLevelKeywords(text):
+        if found.start() < offset:
+            continue
+        if keyword in ("from", "using", "join"):
+            # which table's key would the ranges be of?
+            raise ValueError("Chunked statements can't use other tables with"
+                             " FROM, USING or JOIN: %s"%(text,))
+        if keyword != "where":
+            raise ValueError("Chunked statements can't use RETURNING, ORDER BY"
+                             " or LIMIT: %s"%(text,))
+        if match is None:
+            match = found
+    if match is None:
+        head, condition = text, None
+    else:
+        head, condition = text[:match.start()].rstrip(), text[match.end():].strip()
+    def restrict(low, high):
+        bounds = "%s >= %d AND %s < %d"%(key, low, key, high)
+        if condition is None:
+            return "%s WHERE %s"%(head, bounds)
+        return "%s WHERE (%s) AND (%s)"%(head, bounds, condition)
+    return restrict
+
+
+def tableName(statement, options):
+    if options["table"]:
+        return options["table"]
+    match = TARGET.match(statement)
+    if match is None:
+        raise ValueError("goose:chunk only works on UPDATE and DELETE"
+                         " statements: %s"%(statement.strip(),))
+    return match.group(1)
+
+
+def executeChunked(cursor, statement, options, commit=None, progress=None):
+    """Executes ``statement`` a range of keys at a time.
+
+    commit() is called after each range and progress(done, total, rows)
+    after each range too.  Returns the total rowcount.
+    """
+    options = chunkOptions(options)
+    key = options["key"]
+    table = tableName(statement, options)
+    restrict = chunkTemplate(statement, key)
+    low, high = cursor.execute("SELECT MIN(%s), MAX(%s) FROM %s"%(
+            key, key, table)).fetchone()
+    if low is None:
+        return 0
+    low, high = int(low), int(high)
+    size = options["size"]
+    total = (high - low) // size + 1
+    rows = 0
+    for done, start in enumerate(xrange(low, high + 1, size), 1):
+        result = cursor.execute(restrict(start, start + size).replace("%", "%%"))
+        rows += max(getattr(result, "rowcount", 0) or 0, 0)
+        if commit is not None:
+            commit()
+        if progress is not None:
+            progress(done, total, rows)
+        if options["sleep"] and done < total:
+            time.sleep(options["sleep"])
+    return rows
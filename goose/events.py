@@ -0,0 +1,172 @@
+"""events.py
+
+Machine readable reports of a migration run.
+
+`EventStream` writes one JSON object per line as the run goes::
+
+  goose -d postgresql://db/app -m migrations/ migrate --events -
+
+  {"event": "run_started", "migrations": ["track.sql"], "pending": 1, ...}
+  {"event": "migration_started", "migration": "track.sql", "version": 2, ...}
+  {"bytes": 120, "duration": 0.01, "event": "migration_finished", ...}
+  {"applied": 1, "duration": 0.02, "event": "run_finished", "status": "success", ...}
+
+Every event has a ``time`` (seconds since the epoch) and whatever extra
+fields the stream was created with; failures are reported as
+``migration_failed`` events and a ``run_finished`` event with status
+``failed`` and the ``error``.  Lines are written whole, under a lock, so
+they don't interleave when migrations run in parallel.
+
+`PrometheusTextfile` writes the metrics of a run, in the Prometheus
+text format, for node_exporter's textfile collector to pick up::
+
+  goose ... migrate --metrics-file /var/lib/node_exporter/goose_app.prom
+
+The file is replaced once the run has finished, whether it succeeded
+or not.
+
+"""
+import json
+import os
+import threading
+import time
+
+from goose import instrumentation
+
+
+def errorText(error):
+    return "%s: %s"%(error.__class__.__name__, error)
+
+
+class EventStream(instrumentation.Instrumentation):
+    """
+    Writes a JSON line to ``out`` for everything that happens in a run.
+
+    sizeOf(migrationName), if given, is used to report how many bytes
+    each migration read; ``fields`` are added to every event.
+    """
+    def __init__(self, out, sizeOf=None, **fields):
+        self.out = out
+        self.sizeOf = sizeOf
+        self.fields = fields
+        self.applied = 0
+        self.lock = threading.Lock()
+
+    def emit(self, event, **values):
+        values.update(self.fields)
+        values["event"] = event
+        values["time"] = time.time()
+        line = json.dumps(values, sort_keys=True)
+        with self.lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def beforeRun(self, migrations):
+        self.applied = 0
+        self.emit("run_started", pending=len(migrations),
+                  migrations=[name for version, name in migrations])
+
+    def afterRun(self, elapsed, error):
+        values = {"duration": elapsed, "applied": self.applied,
+                  "status": "success" if error is None else "failed"}
+        if error is not None:
+            values["error"] = errorText(error)
+        self.emit("run_finished", **values)
+
+    def beforeMigration(self, migrationName, version):
+        self.emit("migration_started", migration=migrationName, version=version)
+
+    def afterMigration(self, migrationName, version, elapsed, statementCount):
+        size = None
+        if self.sizeOf is not None:
+            size = self.sizeOf(migrationName)
+        with self.lock:
+            self.applied += 1
+        self.emit("migration_finished", migration=migrationName,
+                  version=version, duration=elapsed,
+                  statements=statementCount, bytes=size)
+
+    def migrationFailed(self, migrationName, version, elapsed, error):
+        self.emit("migration_failed", migration=migrationName, version=version,
+                  duration=elapsed, error=errorText(error))
+
+
+def labelText(labels):
+    if not labels:
+        return ""
+    return "{%s}"%(",".join('%s="%s"'%(name, str(value).replace(
+                    "\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                            for name, value in sorted(labels.items())),)
+
+
+class PrometheusTextfile(instrumentation.Instrumentation):
+    """
+    Collects the metrics of a run and writes them to ``path`` when it
+    finishes.  ``labels`` are added to every metric.
+    """
+    METRICS = (
+        ("goose_migration_duration_seconds", "Seconds taken to apply each migration."),
+        ("goose_migration_statements", "Statements run by each migration."),
+        ("goose_run_duration_seconds", "Seconds taken by the last run."),
+        ("goose_run_migrations_applied", "Migrations applied by the last run."),
+        ("goose_run_migrations_failed", "Migrations that failed in the last run."),
+        ("goose_run_success", "1 if the last run succeeded, 0 if it failed."),
+        ("goose_run_timestamp_seconds", "When the last run finished."),
+    )
+
+    def __init__(self, path, **labels):
+        self.path = path
+        self.labels = labels
+        self.migrations = []
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def beforeRun(self, migrations):
+        with self.lock:
+            self.migrations = []
+            self.failed = 0
+
+    def afterMigration(self, migrationName, version, elapsed, statementCount):
+        with self.lock:
+            self.migrations.append((version, migrationName, elapsed,
+                                    statementCount))
+
+    def migrationFailed(self, migrationName, version, elapsed, error):
+        with self.lock:
+            self.failed += 1
+
+    def samples(self, elapsed, error):
+        """(metric, labels, value) for everything that's written."""
+        samples = []
+        for version, name, duration, statements in sorted(self.migrations):
+            labels = dict(self.labels, migration=name, version=version)
+            samples.append(("goose_migration_duration_seconds", labels, duration))
+            if statements is not None:
+                samples.append(("goose_migration_statements", labels, statements))
+        samples.extend([
+                ("goose_run_duration_seconds", self.labels, elapsed),
+                ("goose_run_migrations_applied", self.labels, len(self.migrations)),
+                ("goose_run_migrations_failed", self.labels, self.failed),
+                ("goose_run_success", self.labels, int(error is None)),
+                ("goose_run_timestamp_seconds", self.labels, time.time())])
+        return samples
+
+    def afterRun(self, elapsed, error):
+        with self.lock:
+            samples = self.samples(elapsed, error)
+        lines = []
+        for metric, help in self.METRICS:
+            values = [(labels, value) for name, labels, value in samples
+                      if name == metric]
+            if not values:
+                continue
+            lines.append("# HELP %s %s"%(metric, help))
+            lines.append("# TYPE %s gauge"%(metric,))
+            for labels, value in values:
+                lines.append("%s%s %r"%(metric, labelText(labels), float(value)))
+        # the collector may read the file at any moment, so replace it
+        # in one go
+        partialPath = "%s.%s.partial"%(self.path, os.getpid())
+        with open(partialPath, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.rename(partialPath, self.path)
@@ -0,0 +1,168 @@
+"""fleet.py
+
+Applies pending migrations to many databases at once.
+
+The index and the statements of each migration are parsed a single
+time and shared by every target, up to a memory budget past which
+migrations are streamed from disk instead; each target gets its own
+connection and runs on one of a fixed number of worker threads::
+
+  goose -m migrations/ fleet --dsn-file shards.txt --workers 16
+
+The DSN file has one DSN per line.  Blank lines and lines starting
+with # are ignored.
+
+"""
+import copy
+import re
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from goose import models
+
+
+APPLIED = "applied"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+PASSWORD = re.compile(r"(://[^:/@]*:)[^@]*@")
+
+# bytes of migrations whose parsed statements are kept for the whole
+# run; the rest are parsed again by each target as they stream by
+CACHE_BYTES = 64 * 1024 * 1024
+
+
+def maskPassword(dsn):
+    return PASSWORD.sub(r"\1***@", dsn)
+
+
+def readDsnFile(path):
+    dsns = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                dsns.append(line)
+    return dsns
+
+
+class FleetResult(object):
+    def __init__(self, dsn, status, applied=(), error=None, elapsed=0.0):
+        self.dsn = dsn
+        self.status = status
+        self.applied = list(applied)
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return "<FleetResult('%s', '%s', %s)>"%(
+            maskPassword(self.dsn), self.status, len(self.applied))
+
+
+class SharedStatements(object):
+    """
+    Parses each migration once no matter how many targets run it.
+
+    Only ``limit`` bytes of migrations are kept parsed; a migration
+    that doesn't fit is streamed by each target, so a huge backfill
+    isn't held in memory for the whole run.  A migration is parsed
+    under a lock of its own, so targets running other migrations
+    don't wait for it.
+    """
+    def __init__(self, migrator, limit=CACHE_BYTES):
+        self.migrator = migrator
+        self.limit = limit
+        self.cached = 0
+        self.cache = {}
+        self.checksums = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def lockFor(self, migrationName):
+        with self.lock:
+            return self.locks.setdefault(migrationName, threading.Lock())
+
+    def reserve(self, size):
+        with self.lock:
+            if self.cached + size > self.limit:
+                return False
+            self.cached += size
+            return True
+
+    def checksum(self, migrationName):
+        with self.lockFor(migrationName):
+            if migrationName not in self.checksums:
+                self.checksums[migrationName] = self.migrator.checksum(
+                    migrationName)
+            return self.checksums[migrationName]
+
+    def __call__(self, migrationName):
+        with self.lockFor(migrationName):
+            if migrationName not in self.cache:
+                if not self.reserve(self.migrator.migrationSize(migrationName)):
+                    return self.migrator.statements(migrationName)
+                self.cache[migrationName] = list(
+                    self.migrator.statements(migrationName))
+            return self.cache[migrationName]
+
+
+class Fleet(object):
+    def __init__(self, migrator, workers=8, failFast=False):
+        self.migrator = migrator
+        self.workers = workers
+        self.failFast = failFast
+        self.statements = SharedStatements(migrator)
+        self.stopped = threading.Event()
+
+    def targetMigrator(self):
+        target = copy.copy(self.migrator)
+        target.statements = self.statements
+        target.checksum = self.statements.checksum
+        target.verbose = False
+        return target
+
+    def migrateTarget(self, dsn, toVersion=None):
+        if self.stopped.is_set():
+            return FleetResult(dsn, SKIPPED)
+        start = time.time()
+        target = self.targetMigrator()
+        try:
+            target.connect(dsn, echo=False)
+            try:
+                applied = target.migrate(toVersion=toVersion)
+            finally:
+                target.close()
+                # a fleet run visits each database once, don't keep a
+                # pool of connections to every one of them
+                models.engines.dispose(dsn)
+        except Exception, e:
+            if self.failFast:
+                self.stopped.set()
+            return FleetResult(dsn, FAILED, error="%s: %s"%(
+                    e.__class__.__name__, e), elapsed=time.time() - start)
+        return FleetResult(dsn, APPLIED, applied, elapsed=time.time() - start)
+
+    def migrate(self, dsns, toVersion=None):
+        """Migrates every DSN and returns a FleetResult for each, in order.
+        """
+        pool = ThreadPool(max(1, min(self.workers, len(dsns))))
+        try:
+            return pool.map(lambda dsn: self.migrateTarget(dsn, toVersion),
+                            dsns, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+
+def printSummary(results):
+    print "%-8s  %-7s  %-8s  %s"%("Status", "Applied", "Seconds", "DSN")
+    for result in results:
+        print "%-8s  %-7s  %-8.2f  %s"%(result.status, len(result.applied),
+                                        result.elapsed, maskPassword(result.dsn))
+        if result.error:
+            print "          %s"%(result.error,)
+    counts = dict((status, 0) for status in (APPLIED, FAILED, SKIPPED))
+    for result in results:
+        counts[result.status] += 1
+    print "%(applied)s applied, %(failed)s failed, %(skipped)s skipped"%counts
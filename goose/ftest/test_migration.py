@@ -1,20 +1,38 @@
+import StringIO
+import distutils.spawn
+import json
 import os
+import shutil
+import sys
+import tempfile
 import unittest
 
+from goose import backup
 from goose import core
+from goose import instrumentation
 from goose import models
+from goose import test
 
 dbFile = ":memory:"
 dbUrl = "sqlite:///%s"%(dbFile,)
 
 
+def setUpModule():
+    global restoreCache
+    restoreCache = test.temporaryCache()
+
+
+def tearDownModule():
+    restoreCache()
+
+
 class TestMigration(unittest.TestCase):
     def setUp(self):
         self.indexFilepath = os.path.join(core.ROOT, "testmigrations",
                                           "index.yaml")
         self.migrator = core.DatabaseMigrator(self.indexFilepath)
         self.migrator.connect(dbUrl)
-        models.init()
+        models.init(self.migrator.engine)
 
     def tearDown(self):
         pass
@@ -101,3 +119,1117 @@ class TestMain(unittest.TestCase):
                 "-t", "2"]
         options = core.main(args, init=True)
         self.assertEquals(options.subCommand, "migrate")
+
+
+class TestBatchedInserts(unittest.TestCase):
+    def test_multiRowInsert(self):
+        session = models.connect(dbUrl)
+        sql = "CREATE TABLE seed (id INT, name VARCHAR(10));\n" + "".join(
+            "INSERT INTO seed (id, name) VALUES (%d, 'row %d');\n" % (i, i)
+            for i in range(250))
+        core.executeBatch(session, sql, batchSize=100)
+        count = session.execute("SELECT count(*), sum(id) FROM seed").fetchone()
+        self.assertEquals(tuple(count), (250, sum(range(250))))
+
+
+class TestMigrateFromBundle(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.bundlePath = os.path.join(self.tempDirectory, "test.goose")
+        migrationDir = os.path.join(core.ROOT, "testmigrations")
+        core.compileMigrations(migrationDir, self.bundlePath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDirectory)
+
+    def test_migrate(self):
+        migrator = core.migrate(self.bundlePath, dbUrl, toVersion=2, init=True)
+        self.assertEqual(migrator.getVersion(), 2)
+        migrator.session.execute("SELECT * FROM test1;")
+        self.assertRaises(models.OperationalError, migrator.migrate)
+        self.assertEqual(migrator.getVersion(), 2)
+
+
+class TestFleet(unittest.TestCase):
+    def setUp(self):
+        self.migrationDir = os.path.join(core.ROOT, "testmigrations")
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsns = []
+        for i in range(4):
+            dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory,
+                                               "shard%s.db"%(i,)),)
+            self.dsns.append(dsn)
+            models.connect(dsn, echo=False).bind.dispose()
+            models.init()
+        # this one was never initialized so migrating it will fail
+        self.broken = "sqlite:///%s"%(os.path.join(self.tempDirectory,
+                                                   "broken.db"),)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDirectory)
+
+    def test_migrateFleet(self):
+        from goose import fleet
+        dsns = self.dsns[:2] + [self.broken] + self.dsns[2:]
+        results = core.migrateFleet(self.migrationDir, dsns, workers=3,
+                                    toVersion=2)
+        self.assertEqual([r.dsn for r in results], dsns)
+        self.assertEqual([r.status for r in results],
+                         [fleet.APPLIED, fleet.APPLIED, fleet.FAILED,
+                          fleet.APPLIED, fleet.APPLIED])
+        self.assertEqual(results[0].applied, ["create.sql", "track.sql"])
+        for dsn in self.dsns:
+            migrator = core.getMigrator(self.migrationDir)
+            migrator.connect(dsn, echo=False)
+            self.assertEqual(migrator.getVersion(), 2)
+
+    def test_failFast(self):
+        from goose import fleet
+        dsns = [self.broken] + self.dsns
+        results = core.migrateFleet(self.migrationDir, dsns, workers=1,
+                                    failFast=True, toVersion=2)
+        self.assertEqual([r.status for r in results],
+                         [fleet.FAILED] + [fleet.SKIPPED] * 4)
+
+    def test_sharedStatementsLimit(self):
+        from goose import fleet
+        migrator = core.getMigrator(self.migrationDir)
+        statements = fleet.SharedStatements(
+            migrator, limit=migrator.migrationSize("create.sql"))
+        self.assertEqual(statements("create.sql"), statements("create.sql"))
+        self.assertEqual(statements.cache.keys(), ["create.sql"])
+        # over the limit, so it's streamed rather than kept
+        self.assertEqual(list(statements("track.sql")),
+                         list(migrator.statements("track.sql")))
+        self.assertEqual(statements.cache.keys(), ["create.sql"])
+
+    def test_main(self):
+        dsnFile = os.path.join(self.tempDirectory, "dsns.txt")
+        with open(dsnFile, "w") as f:
+            f.write("# shards\n\n%s\n"%("\n".join(self.dsns),))
+        args = ["-m", self.migrationDir, "fleet", "--dsn-file", dsnFile,
+                "-t", "2"]
+        options = core.main(args)
+        self.assertEquals(options.subCommand, "fleet")
+
+
+class TestAsyncDatabaseMigrator(unittest.TestCase):
+    def setUp(self):
+        from goose import asynchronous
+        from multiprocessing.pool import ThreadPool
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsns = []
+        for i in range(3):
+            dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory,
+                                               "db%s.db"%(i,)),)
+            self.dsns.append(dsn)
+            models.connect(dsn, echo=False).bind.dispose()
+            models.init()
+        self.pool = ThreadPool(2)
+        self.migrator = asynchronous.AsyncDatabaseMigrator(
+            core.getMigrator(os.path.join(core.ROOT, "testmigrations")),
+            pool=self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.tempDirectory)
+
+    def test_migrateAndGetVersion(self):
+        results = [self.migrator.migrate(dsn, toVersion=2)
+                   for dsn in self.dsns]
+        for result in results:
+            self.assertEqual(result.get(10), ["create.sql", "track.sql"])
+        versions = [self.migrator.getVersion(dsn) for dsn in self.dsns]
+        self.assertEqual([v.get(10) for v in versions], [2, 2, 2])
+
+    def test_errorsAreRaisedByGet(self):
+        result = self.migrator.migrate(self.dsns[0])
+        self.assertRaises(models.OperationalError, result.get, 10)
+
+    def test_callback(self):
+        versions = []
+        self.migrator.getVersion(self.dsns[0], callback=versions.append).wait(10)
+        self.assertEqual(versions, [None])
+
+
+class TestOutOfOrderMigrations(unittest.TestCase):
+    def setUp(self):
+        self.indexFilepath = os.path.join(core.ROOT, "testmigrations",
+                                          "index.yaml")
+        self.migrator = core.DatabaseMigrator(self.indexFilepath)
+        self.migrator.connect(dbUrl)
+        models.init(self.migrator.engine)
+
+    def test_skippedMigrationsAreApplied(self):
+        self.assertEqual(self.migrator.migrate(selectedMigrations=[1]),
+                         ["track.sql"])
+        self.assertEqual(self.migrator.plan().gaps, [(1, "create.sql")])
+        self.assertEqual(self.migrator.migrate(toVersion=2), ["create.sql"])
+        applied = sorted((m.version, m.name)
+                         for m in self.migrator.migrationsApplied())
+        self.assertEqual(applied, [(1, "create.sql"), (2, "track.sql")])
+
+    def test_mismatchedIndexIsAnError(self):
+        self.migrator.migrate(toVersion=2)
+        self.migrator.migrations = ["track.sql", "create.sql",
+                                    "bad.sql", "good.sql"]
+        self.assertRaises(ValueError, self.migrator.migrate)
+
+
+class TestSchemaUpgrade(unittest.TestCase):
+    """migration_info tables created before schema version 2"""
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "v1.db"),)
+        self.migrator = core.getMigrator(os.path.join(core.ROOT,
+                                                      "testmigrations"))
+        self.migrator.connect(self.dsn)
+        self.bind = self.migrator.session.bind
+        self.bind.execute("""CREATE TABLE migration_info (
+            migration_id INTEGER NOT NULL,
+            version INTEGER,
+            name VARCHAR(256),
+            migration_date DATETIME,
+            PRIMARY KEY (migration_id))""")
+
+    def tearDown(self):
+        self.bind.dispose()
+        shutil.rmtree(self.tempDirectory)
+
+    def test_freshDatabaseIsCurrent(self):
+        session = models.connect(dbUrl)
+        models.init()
+        self.assertEqual(models.schemaVersion(session.bind),
+                         models.SCHEMA_VERSION)
+
+    def test_version1(self):
+        self.assertEqual(models.schemaVersion(self.bind), 1)
+        self.assertEqual(self.migrator.migrate(toVersion=1), ["create.sql"])
+        [migration] = self.migrator.migrationsApplied()
+        self.assertEqual(migration.name, "create.sql")
+
+    def test_upgrade(self):
+        self.migrator.migrate(toVersion=1)
+        self.assertEqual(models.upgrade(self.bind), 2)
+        self.assertEqual(models.schemaVersion(self.bind), 2)
+        # upgrading again is harmless
+        self.assertEqual(models.upgrade(self.bind), 2)
+        self.migrator.connect(self.dsn)
+        self.migrator.migrate(toVersion=2)
+        old, new = self.migrator.session.query(models.Migration).order_by(
+            models.Migration.version).all()
+        self.assertEqual((old.checksum, old.statementCount), (None, None))
+        self.assertEqual(new.checksum, self.migrator.checksum("track.sql"))
+        self.assertEqual(new.statementCount, 2)
+        self.assertTrue(new.duration >= 0)
+        indexes = set(i["name"] for i in models.reflection.Inspector.from_engine(
+                self.bind).get_indexes("migration_info"))
+        self.assertEqual(indexes, set(["ix_migration_info_version",
+                                       "ix_migration_info_name"]))
+
+    def test_main(self):
+        options = core.main(["-d", self.dsn, "init", "--upgrade"])
+        self.assertEqual(models.schemaVersion(self.bind), 2)
+
+
+class RecordingInstrument(instrumentation.Instrumentation):
+    def __init__(self):
+        self.calls = []
+
+    def beforeMigration(self, migrationName, version):
+        self.calls.append(("beforeMigration", migrationName, version))
+
+    def afterMigration(self, migrationName, version, elapsed, statementCount):
+        self.calls.append(("afterMigration", migrationName, version,
+                           statementCount))
+
+    def afterStatement(self, migrationName, version, statement, elapsed,
+                       rowcount):
+        self.calls.append(("afterStatement", migrationName, statement.offset))
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.migrator = core.DatabaseMigrator(
+            os.path.join(core.ROOT, "testmigrations", "index.yaml"))
+        self.migrator.connect(dbUrl)
+        models.init(self.migrator.engine)
+
+    def test_hooks(self):
+        instrument = RecordingInstrument()
+        report = instrumentation.SlowStatementReport(3)
+        self.migrator.instruments.extend([instrument, report])
+        self.migrator.migrate(toVersion=1)
+        self.assertEqual(instrument.calls[0], ("beforeMigration", "create.sql", 1))
+        self.assertEqual(instrument.calls[-1][:3], ("afterMigration", "create.sql", 1))
+        statements = [call for call in instrument.calls
+                      if call[0] == "afterStatement"]
+        self.assertEqual(len(statements), instrument.calls[-1][3])
+        self.assertEqual(len(report.entries()), min(3, len(statements)))
+
+    def test_slowestOption(self):
+        options = core.main(["-m", os.path.join(core.ROOT, "testmigrations"),
+                             "-d", dbUrl, "migrate", "-t", "2",
+                             "--slowest", "5"], init=True)
+        self.assertEqual(options.slowest, 5)
+        self.assertFalse(options.echo)
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.metricsFile = os.path.join(self.tempDirectory, "goose.prom")
+        self.out = StringIO.StringIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDirectory)
+
+    def migrate(self, **kwargs):
+        core.migrate(os.path.join(core.ROOT, "testmigrations"), dbUrl,
+                     init=True, eventLog=self.out, metricsFile=self.metricsFile,
+                     verbose=False, **kwargs)
+
+    def events(self):
+        return [json.loads(line) for line in self.out.getvalue().splitlines()]
+
+    def metrics(self):
+        with open(self.metricsFile) as f:
+            return f.read()
+
+    def test_success(self):
+        self.migrate(toVersion=2)
+        events = self.events()
+        self.assertEqual([event["event"] for event in events],
+                         ["run_started", "migration_started", "migration_finished",
+                          "migration_started", "migration_finished",
+                          "run_finished"])
+        finished = events[2]
+        self.assertEqual((finished["migration"], finished["version"],
+                          finished["statements"], finished["dsn"]),
+                         ("create.sql", 1, 1, dbUrl))
+        self.assertEqual(finished["bytes"], os.path.getsize(
+                os.path.join(core.ROOT, "testmigrations", "create.sql")))
+        self.assertEqual((events[-1]["status"], events[-1]["applied"]),
+                         ("success", 2))
+        metrics = self.metrics()
+        self.assertTrue('goose_migration_statements{dsn="%s",migration="track.sql",'
+                        'version="2"} 2.0\n'%(dbUrl,) in metrics, metrics)
+        self.assertTrue('goose_run_success{dsn="%s"} 1.0\n'%(dbUrl,) in metrics)
+
+    def test_failure(self):
+        self.assertRaises(models.OperationalError, self.migrate)
+        events = self.events()
+        self.assertEqual(events[-2]["event"], "migration_failed")
+        self.assertEqual(events[-2]["migration"], "bad.sql")
+        self.assertTrue(events[-2]["error"].startswith("OperationalError: "))
+        self.assertEqual((events[-1]["status"], events[-1]["applied"]),
+                         ("failed", 2))
+        metrics = self.metrics()
+        self.assertTrue('goose_run_success{dsn="%s"} 0.0\n'%(dbUrl,) in metrics)
+        self.assertTrue('goose_run_migrations_failed{dsn="%s"} 1.0\n'%(dbUrl,)
+                        in metrics)
+
+    def test_allMode(self):
+        self.assertRaises(models.OperationalError, self.migrate,
+                          transactionMode="all")
+        failed = [event for event in self.events()
+                  if event["event"] == "migration_failed"]
+        self.assertEqual([event["migration"] for event in failed], ["bad.sql"])
+
+    def test_failureBeforeTheRun(self):
+        dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "empty.db"),)
+        self.assertRaises(ValueError, core.migrate,
+                          os.path.join(core.ROOT, "testmigrations"), dsn,
+                          eventLog=self.out, verbose=False)
+        models.engines.dispose(dsn)
+        [event] = self.events()
+        self.assertEqual((event["event"], event["status"]),
+                         ("run_finished", "failed"))
+        self.assertTrue(event["error"].startswith("ValueError: Unable to"))
+
+    def test_reportsStayOffStdout(self):
+        dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "backed.db"),)
+        stdout = sys.stdout
+        sys.stdout = self.out
+        try:
+            core.migrate(os.path.join(core.ROOT, "testmigrations"), dsn,
+                         init=True, eventLog=self.out, verbose=False,
+                         toVersion=2, slowest=2,
+                         backup=os.path.join(self.tempDirectory, "backup"))
+        finally:
+            sys.stdout = stdout
+            models.engines.dispose(dsn)
+        self.assertEqual(len(self.events()), 6)
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.profileDirectory = os.path.join(self.tempDirectory, "profile")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDirectory)
+
+    def test_profile(self):
+        import pstats
+        migrator = core.migrate(os.path.join(core.ROOT, "testmigrations"),
+                                dbUrl, toVersion=2, init=True, verbose=False,
+                                profile=self.profileDirectory)
+        self.assertEqual(sorted(os.listdir(self.profileDirectory)),
+                         ["0001-create.sql.pstats", "0002-track.sql.pstats"])
+        pstats.Stats(os.path.join(self.profileDirectory, "0002-track.sql.pstats"))
+        profiles = migrator.profiler.profiles
+        self.assertEqual([p.migrationName for p in profiles],
+                         ["create.sql", "track.sql"])
+        for profile in profiles:
+            self.assertTrue(0 < profile.driver <= profile.wall, profile.__dict__)
+        report = migrator.profiler.report()
+        self.assertEqual(len(report), 4)
+        self.assertTrue(report[2].startswith("2 "))
+
+    def test_failedMigrationIsProfiled(self):
+        self.assertRaises(models.OperationalError, core.migrate,
+                          os.path.join(core.ROOT, "testmigrations"), dbUrl,
+                          init=True, verbose=False, transactionMode="all",
+                          profile=self.profileDirectory)
+        self.assertTrue("0003-bad.sql.pstats" in os.listdir(self.profileDirectory))
+
+    def test_main(self):
+        options = core.main(["--profile", self.profileDirectory,
+                             "-m", os.path.join(core.ROOT, "testmigrations"),
+                             "-d", dbUrl, "migrate", "-t", "1"], init=True)
+        self.assertEqual(options.profile, self.profileDirectory)
+        self.assertEqual(os.listdir(self.profileDirectory),
+                         ["0001-create.sql.pstats"])
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "render.db"),)
+        self.migrationDir = os.path.join(core.ROOT, "testmigrations")
+        models.connect(self.dsn).bind.dispose()
+        models.init()
+
+    def tearDown(self):
+        models.metadata.bind.dispose()
+        shutil.rmtree(self.tempDirectory)
+
+    def test_render(self):
+        out = StringIO.StringIO()
+        rendered = core.renderMigrations(self.migrationDir, self.dsn,
+                                         toVersion=2, out=out)
+        self.assertEqual(rendered, [(1, "create.sql"), (2, "track.sql")])
+        script = out.getvalue()
+        self.assertTrue(script.startswith(".bail on\n"))
+        self.assertEqual(script.count("BEGIN;\n"), 2)
+        self.assertTrue("INSERT INTO migration_info (version, name, checksum,"
+                        " statement_count, migration_date) VALUES (2,"
+                        " 'track.sql'," in script)
+        # nothing was applied
+        migrator = core.getMigrator(self.migrationDir)
+        migrator.connect(self.dsn)
+        self.assertEqual(migrator.getVersion(), None)
+
+    def test_viaClient(self):
+        if not distutils.spawn.find_executable("sqlite3"):
+            self.skipTest("sqlite3 isn't installed")
+        core.renderMigrations(self.migrationDir, self.dsn, toVersion=2,
+                              viaClient=True)
+        migrator = core.getMigrator(self.migrationDir)
+        migrator.connect(self.dsn)
+        self.assertEqual(migrator.getVersion(), 2)
+        recorded = migrator.session.query(models.Migration).filter_by(
+            version=2).one()
+        self.assertEqual(recorded.checksum, migrator.checksum("track.sql"))
+        self.assertEqual(recorded.statementCount, 2)
+        migrator.session.execute("SELECT * FROM Track")
+
+    def test_viaClientStopsAtFailure(self):
+        if not distutils.spawn.find_executable("sqlite3"):
+            self.skipTest("sqlite3 isn't installed")
+        self.assertRaises(ValueError, core.renderMigrations,
+                          self.migrationDir, self.dsn, viaClient=True)
+        migrator = core.getMigrator(self.migrationDir)
+        migrator.connect(self.dsn)
+        self.assertEqual(migrator.getVersion(), 2)
+
+
+class TestTransactionModes(unittest.TestCase):
+    def setUp(self):
+        self.migrator = core.getMigrator(os.path.join(core.ROOT,
+                                                      "testmigrations"))
+        self.migrator.connect(dbUrl)
+        models.init(self.migrator.engine)
+
+    def recorded(self):
+        return [(m.version, m.name, m.statementCount) for m in
+                self.migrator.session.query(models.Migration).order_by(
+                models.Migration.version)]
+
+    def test_all(self):
+        self.migrator.transactionMode = "all"
+        self.assertEqual(self.migrator.migrate(toVersion=2),
+                         ["create.sql", "track.sql"])
+        self.assertEqual(self.recorded(), [(1, "create.sql", 1),
+                                           (2, "track.sql", 2)])
+
+    def test_allIsAllOrNothing(self):
+        self.migrator.transactionMode = "all"
+        self.assertRaises(models.OperationalError, self.migrator.migrate)
+        self.assertEqual(self.recorded(), [])
+
+    def test_none(self):
+        self.migrator.transactionMode = "none"
+        self.assertRaises(models.OperationalError, self.migrator.migrate)
+        self.assertEqual(self.recorded(), [(1, "create.sql", 1),
+                                           (2, "track.sql", 2)])
+
+    def test_unknownMode(self):
+        self.migrator.transactionMode = "some"
+        self.assertRaises(ValueError, self.migrator.migrate)
+
+    def test_main(self):
+        options = core.main(["-m", os.path.join(core.ROOT, "testmigrations"),
+                             "-d", dbUrl, "migrate", "-t", "2",
+                             "--transaction-mode", "all"], init=True)
+        self.assertEqual(options.transactionMode, "all")
+
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "resume.db"),)
+        with open(os.path.join(self.tempDirectory, "index.yaml"), "w") as f:
+            f.write("migrations:\n - load.sql\n")
+        self.writeMigration()
+        models.connect(self.dsn).bind.dispose()
+        models.init()
+
+    def tearDown(self):
+        models.metadata.bind.dispose()
+        shutil.rmtree(self.tempDirectory)
+
+    def writeMigration(self, extra=""):
+        with open(os.path.join(self.tempDirectory, "load.sql"), "w") as f:
+            f.write("CREATE TABLE a (id INT);\n"
+                    "INSERT INTO a VALUES (1);\n"
+                    "INSERT INTO b VALUES (2);\n"
+                    "INSERT INTO a VALUES (3);\n" + extra)
+
+    def migrator(self, resume=False):
+        migrator = core.getMigrator(self.tempDirectory)
+        migrator.transactionMode = "none"
+        migrator.resume = resume
+        migrator.connect(self.dsn)
+        return migrator
+
+    def test_resume(self):
+        migrator = self.migrator()
+        self.assertRaises(models.OperationalError, migrator.migrate)
+        self.assertEqual(models.loadProgress(migrator.session, "load.sql"),
+                         (migrator.checksum("load.sql"), None, 2))
+        migrator.session.execute("CREATE TABLE b (id INT)")
+        migrator = self.migrator(resume=True)
+        self.assertEqual(migrator.migrate(), ["load.sql"])
+        rows = migrator.session.execute("SELECT id FROM a ORDER BY id").fetchall()
+        self.assertEqual([row[0] for row in rows], [1, 3])
+        self.assertEqual(models.loadProgress(migrator.session, "load.sql"), None)
+        recorded = migrator.session.query(models.Migration).one()
+        self.assertEqual(recorded.statementCount, 4)
+
+    def test_everyStatementIsCommitted(self):
+        # SQLAlchemy wouldn't commit a REPLACE on its own
+        with open(os.path.join(self.tempDirectory, "load.sql"), "w") as f:
+            f.write("CREATE TABLE a (id INT PRIMARY KEY);\n"
+                    "REPLACE INTO a VALUES (1);\n")
+        migrator = self.migrator()
+        self.assertEqual(migrator.migrate(), ["load.sql"])
+        migrator.close()
+        models.engines.dispose(self.dsn)
+        rows = self.migrator().session.execute("SELECT id FROM a").fetchall()
+        self.assertEqual([row[0] for row in rows], [1])
+
+    def test_resumeAfterStatementsSQLAlchemyWouldNotCommit(self):
+        with open(os.path.join(self.tempDirectory, "load.sql"), "w") as f:
+            f.write("CREATE TABLE a (id INT PRIMARY KEY);\n"
+                    "REPLACE INTO a VALUES (1);\n"
+                    "INSERT INTO b VALUES (2);\n"
+                    "INSERT INTO a VALUES (3);\n")
+        migrator = self.migrator()
+        self.assertRaises(models.OperationalError, migrator.migrate)
+        self.assertEqual(models.loadProgress(migrator.session, "load.sql")[2], 2)
+        migrator.session.execute("CREATE TABLE b (id INT)")
+        migrator.close()
+        models.engines.dispose(self.dsn)
+        migrator = self.migrator(resume=True)
+        self.assertEqual(migrator.migrate(), ["load.sql"])
+        # the skipped REPLACE took effect the first time round
+        rows = migrator.session.execute("SELECT id FROM a ORDER BY id").fetchall()
+        self.assertEqual([row[0] for row in rows], [1, 3])
+
+    def test_changedFileIsNotResumed(self):
+        migrator = self.migrator()
+        self.assertRaises(models.OperationalError, migrator.migrate)
+        self.writeMigration("INSERT INTO a VALUES (4);\n")
+        self.assertRaises(ValueError, self.migrator(resume=True).migrate)
+
+    def test_withoutResumeStartsOver(self):
+        migrator = self.migrator()
+        self.assertRaises(models.OperationalError, migrator.migrate)
+        migrator.session.execute("DROP TABLE a")
+        migrator.session.execute("CREATE TABLE b (id INT)")
+        self.assertEqual(self.migrator().migrate(), ["load.sql"])
+
+    def test_main(self):
+        migrator = self.migrator()
+        self.assertRaises(models.OperationalError, migrator.migrate)
+        migrator.session.execute("CREATE TABLE b (id INT)")
+        options = core.main(["-m", self.tempDirectory, "-d", self.dsn,
+                             "migrate", "--resume"])
+        self.assertTrue(options.resume)
+        self.assertEqual(self.migrator().getVersion(), 1)
+
+
+class TestParallelMigrations(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "dag.db"),)
+        files = {"users.sql": "CREATE TABLE users (id INT);",
+                 "orders.sql": "CREATE TABLE orders (id INT);",
+                 "seed_users.sql": "INSERT INTO users VALUES (1);",
+                 "seed_orders.sql": "INSERT INTO orders VALUES (1);"}
+        for name, sql in files.items():
+            with open(os.path.join(self.tempDirectory, name), "w") as f:
+                f.write(sql + "\n")
+        with open(os.path.join(self.tempDirectory, "index.yaml"), "w") as f:
+            f.write("migrations:\n"
+                    " - users.sql\n"
+                    " - name: orders.sql\n"
+                    "   depends: []\n"
+                    " - name: seed_users.sql\n"
+                    "   depends: [users.sql]\n"
+                    " - name: seed_orders.sql\n"
+                    "   depends: [orders.sql]\n")
+        models.connect(self.dsn).bind.dispose()
+        models.init()
+
+    def tearDown(self):
+        models.metadata.bind.dispose()
+        shutil.rmtree(self.tempDirectory)
+
+    def test_jobs(self):
+        from goose import scheduler
+        # one writer at a time, so --jobs is ignored for SQLite
+        Scheduler = scheduler.Scheduler
+        scheduler.Scheduler = None
+        try:
+            migrator = core.migrate(self.tempDirectory, self.dsn, jobs=3)
+        finally:
+            scheduler.Scheduler = Scheduler
+        plan = migrator.plan()
+        self.assertEqual(plan.pending, [])
+        self.assertTrue(plan.isConsistent())
+        self.assertEqual(migrator.session.execute(
+                "SELECT count(*) FROM orders").scalar(), 1)
+
+
+SLUGS = '''
+def forward(migration):
+    for rows in migration.iterChunks("SELECT id, name FROM users ORDER BY id",
+                                     size=10):
+        migration.writeMany("UPDATE users SET slug = :slug WHERE id = :id",
+                            [(name.lower().replace(" ", "-"), id)
+                             for id, name in rows])
+'''
+
+
+class TestPythonMigrations(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "py.db"),)
+        self.write("users.sql",
+                   "CREATE TABLE users (id INT, name VARCHAR(64), slug VARCHAR(64));\n" +
+                   "".join("INSERT INTO users (id, name) VALUES (%d, 'User %d');\n"%(i, i)
+                           for i in range(25)))
+        self.write("slugs.py", SLUGS)
+        self.write("index.yaml", "migrations:\n - users.sql\n - slugs.py\n")
+        models.connect(self.dsn).bind.dispose()
+        models.init()
+
+    def tearDown(self):
+        models.metadata.bind.dispose()
+        shutil.rmtree(self.tempDirectory)
+
+    def write(self, name, text):
+        with open(os.path.join(self.tempDirectory, name), "w") as f:
+            f.write(text)
+
+    def migrator(self, path=None):
+        migrator = core.getMigrator(path or self.tempDirectory)
+        migrator.connect(self.dsn)
+        return migrator
+
+    def slugs(self, migrator):
+        return [row[0] for row in migrator.session.execute(
+                "SELECT slug FROM users ORDER BY id")]
+
+    def test_forward(self):
+        migrator = self.migrator()
+        self.assertEqual(migrator.migrate(), ["users.sql", "slugs.py"])
+        self.assertEqual(self.slugs(migrator),
+                         ["user-%d"%(i,) for i in range(25)])
+        recorded = migrator.session.query(models.Migration).filter_by(
+            name="slugs.py").one()
+        # one query and three chunks of writes
+        self.assertEqual(recorded.statementCount, 4)
+        self.assertEqual(recorded.checksum, migrator.checksum("slugs.py"))
+
+    def test_failureRollsBack(self):
+        self.write("slugs.py", SLUGS + "    raise ValueError('stop')\n")
+        migrator = self.migrator()
+        self.assertRaises(ValueError, migrator.migrate)
+        self.assertEqual(self.slugs(migrator), [None] * 25)
+        self.assertEqual(migrator.getVersion(), 1)
+
+    def test_noTransaction(self):
+        migrator = self.migrator()
+        migrator.transactionMode = "none"
+        self.assertRaises(ValueError, migrator.migrate)
+        self.assertEqual(migrator.getVersion(), None)
+
+    def test_missingForward(self):
+        self.write("slugs.py", "def backward(migration):\n    pass\n")
+        migrator = self.migrator()
+        self.assertRaises(ValueError, migrator.migrate)
+        self.assertEqual(migrator.getVersion(), 1)
+
+    def test_bundle(self):
+        bundlePath = os.path.join(self.tempDirectory, "release.goose")
+        core.compileMigrations(self.tempDirectory, bundlePath)
+        migrator = self.migrator(bundlePath)
+        migrator.migrate()
+        self.assertEqual(self.slugs(migrator)[-1], "user-24")
+
+
+class TestChunkedStatements(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "chunk.db"),)
+        with open(os.path.join(self.tempDirectory, "index.yaml"), "w") as f:
+            f.write("migrations:\n - create.sql\n - backfill.sql\n")
+        with open(os.path.join(self.tempDirectory, "create.sql"), "w") as f:
+            f.write("CREATE TABLE a (id INTEGER PRIMARY KEY, x INT);\n")
+            f.write("".join("INSERT INTO a (id) VALUES (%d);\n"%(i,)
+                            for i in xrange(1, 26)))
+        with open(os.path.join(self.tempDirectory, "backfill.sql"), "w") as f:
+            f.write("-- goose:chunk key=id size=10\n"
+                    "UPDATE a SET x = id * 2 WHERE id NOT IN (5, 10, 15, 20, 25);\n")
+        models.connect(self.dsn).bind.dispose()
+        models.init()
+        self.migrator = core.getMigrator(self.tempDirectory)
+        self.migrator.connect(self.dsn)
+        self.commits = 0
+        commitChunk = self.migrator.commitChunk
+        def countingCommit():
+            self.commits += 1
+            commitChunk()
+        self.migrator.commitChunk = countingCommit
+
+    def tearDown(self):
+        models.metadata.bind.dispose()
+        shutil.rmtree(self.tempDirectory)
+
+    def test_chunked(self):
+        self.assertEqual(self.migrator.migrate(), ["create.sql", "backfill.sql"])
+        self.assertEqual(self.commits, 3)
+        rows = self.migrator.session.execute(
+            "SELECT id, x FROM a ORDER BY id").fetchall()
+        self.assertEqual(rows, [(i, None if i % 5 == 0 else i * 2)
+                                for i in xrange(1, 26)])
+        recorded = self.migrator.session.query(models.Migration).filter_by(
+            name="backfill.sql").one()
+        self.assertEqual(recorded.statementCount, 1)
+
+    def test_allModeDoesNotCommitChunks(self):
+        self.migrator.transactionMode = "all"
+        self.migrator.migrate()
+        self.assertEqual(self.commits, 0)
+        count = self.migrator.session.execute(
+            "SELECT count(*) FROM a WHERE x IS NOT NULL").scalar()
+        self.assertEqual(count, 20)
+
+    def test_renderRefusesChunks(self):
+        out = StringIO.StringIO()
+        self.assertRaises(ValueError, core.renderMigrations, self.tempDirectory,
+                          self.dsn, out=out)
+        self.assertEqual(out.getvalue(), "")
+
+
+class TestBackup(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.database = os.path.join(self.tempDirectory, "backup.db")
+        self.dsn = "sqlite:///%s"%(self.database,)
+        self.backupPath = os.path.join(self.tempDirectory, "backup.db.backup")
+        self.migrationDir = os.path.join(core.ROOT, "testmigrations")
+        models.connect(self.dsn).bind.dispose()
+        models.init()
+        self.hasShell = backup.hasShell
+
+    def tearDown(self):
+        backup.hasShell = self.hasShell
+        models.metadata.bind.dispose()
+        shutil.rmtree(self.tempDirectory)
+
+    def version(self):
+        migrator = core.getMigrator(self.migrationDir)
+        migrator.connect(self.dsn)
+        try:
+            return migrator.getVersion()
+        finally:
+            migrator.session.bind.dispose()
+
+    def backupAndRestore(self):
+        self.assertRaises(models.OperationalError, core.migrate,
+                          self.migrationDir, self.dsn, backup=self.backupPath)
+        self.assertTrue(os.path.exists(self.backupPath))
+        self.assertEqual(self.version(), 2)
+        core.restoreDatabase(self.dsn, self.backupPath)
+        self.assertEqual(self.version(), None)
+        # the tables the migrations made went with them
+        import sqlite3
+        connection = sqlite3.connect(self.database)
+        try:
+            self.assertEqual(connection.execute(
+                    "SELECT name FROM sqlite_master WHERE name = 'Track'").fetchall(), [])
+        finally:
+            connection.close()
+
+    def test_shell(self):
+        if not distutils.spawn.find_executable("sqlite3"):
+            self.skipTest("sqlite3 isn't installed")
+        self.backupAndRestore()
+
+    def test_withoutShell(self):
+        backup.hasShell = lambda dsn: False
+        self.backupAndRestore()
+
+    def test_nothingToBackUp(self):
+        core.migrate(self.migrationDir, self.dsn, toVersion=2)
+        core.migrate(self.migrationDir, self.dsn, toVersion=2,
+                     backup=self.backupPath)
+        self.assertFalse(os.path.exists(self.backupPath))
+
+    def test_main(self):
+        backup.hasShell = lambda dsn: False
+        options = core.main(["-m", self.migrationDir, "-d", self.dsn,
+                             "migrate", "-t", "1", "--backup", self.backupPath])
+        self.assertEqual(options.backup, self.backupPath)
+        self.assertEqual(self.version(), 1)
+        core.main(["-d", self.dsn, "restore", self.backupPath])
+        self.assertEqual(self.version(), None)
+
+    def test_missingBackup(self):
+        self.assertRaises(ValueError, core.restoreDatabase, self.dsn,
+                          os.path.join(self.tempDirectory, "nothing"))
+
+
+class TestEngineRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsns = ["sqlite:///%s"%(os.path.join(self.tempDirectory, name),)
+                     for name in ("one.db", "two.db")]
+        self.engines = models.EngineRegistry()
+
+    def tearDown(self):
+        self.engines.dispose()
+        for dsn in self.dsns:
+            models.engines.dispose(dsn)
+        shutil.rmtree(self.tempDirectory)
+
+    def test_enginesAreShared(self):
+        one, two = self.dsns
+        self.assertTrue(self.engines.engine(one) is self.engines.engine(one))
+        self.assertFalse(self.engines.engine(one) is self.engines.engine(two))
+        self.assertFalse(self.engines.engine(one) is
+                         self.engines.engine(one, pool_recycle=60))
+        self.assertEqual(len(self.engines), 3)
+
+    def test_inMemoryEnginesAreNotShared(self):
+        self.assertFalse(self.engines.engine(dbUrl) is self.engines.engine(dbUrl))
+        self.assertEqual(len(self.engines), 0)
+
+    def test_dispose(self):
+        one, two = self.dsns
+        engine = self.engines.engine(one)
+        self.engines.engine(two)
+        self.assertEqual(self.engines.dispose(one), 1)
+        self.assertFalse(self.engines.engine(one) is engine)
+        self.assertEqual(self.engines.dispose(), 2)
+        self.assertEqual(len(self.engines), 0)
+
+    def test_migratorsKeepTheirOwnEngines(self):
+        bound = models.metadata.bind
+        migrators = []
+        for dsn in self.dsns:
+            migrator = core.getMigrator(os.path.join(core.ROOT, "testmigrations"))
+            migrator.verbose = False
+            migrator.connect(dsn)
+            models.init(migrator.engine)
+            migrators.append(migrator)
+        self.assertTrue(models.metadata.bind is bound)
+        first, second = migrators
+        self.assertEqual(first.migrate(toVersion=1), ["create.sql"])
+        self.assertEqual(second.migrate(toVersion=2), ["create.sql", "track.sql"])
+        self.assertEqual((first.getVersion(), second.getVersion()), (1, 2))
+        again = core.getMigrator(os.path.join(core.ROOT, "testmigrations"))
+        again.connect(self.dsns[0])
+        self.assertTrue(again.engine is first.engine)
+
+
+class TestTemplateDatabase(unittest.TestCase):
+    def setUp(self):
+        from goose import testing
+        self.tempDirectory = tempfile.mkdtemp()
+        self.dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "template.db"),)
+        self.migrationDir = os.path.join(core.ROOT, "testmigrations")
+        self.template = testing.TemplateDatabase(self.migrationDir, self.dsn,
+                                                 toVersion=2)
+
+    def tearDown(self):
+        self.template.cleanup()
+        shutil.rmtree(self.tempDirectory)
+
+    def version(self, dsn):
+        migrator = core.getMigrator(self.migrationDir)
+        migrator.connect(dsn)
+        try:
+            return migrator.getVersion()
+        finally:
+            migrator.close()
+            models.engines.dispose(dsn)
+
+    def test_clonesAreMigratedAndIndependent(self):
+        first = self.template.clone()
+        second = self.template.clone()
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.version(first), 2)
+        models.engines.engine(first).execute("DELETE FROM migration_info")
+        models.engines.dispose(first)
+        self.assertEqual(self.version(first), None)
+        self.assertEqual(self.version(second), 2)
+        self.assertEqual(self.version(self.dsn), 2)
+
+    def test_templateIsMigratedOnce(self):
+        from goose import testing
+        self.assertEqual(self.template.prepare(), ["create.sql", "track.sql"])
+        self.assertEqual(self.template.prepare(), [])
+        again = testing.TemplateDatabase(self.migrationDir, self.dsn, toVersion=2)
+        self.assertEqual(again.prepare(), [])
+
+    def test_mismatchedTemplateIsRebuilt(self):
+        from goose import testing
+        self.template.prepare()
+        engine = models.engines.engine(self.dsn)
+        engine.execute("UPDATE migration_info SET name = 'other.sql'"
+                       " WHERE version = 1")
+        models.engines.dispose(self.dsn)
+        again = testing.TemplateDatabase(self.migrationDir, self.dsn, toVersion=2)
+        self.assertEqual(again.prepare(), ["create.sql", "track.sql"])
+
+    def test_cloned(self):
+        with self.template.cloned() as dsn:
+            path = dsn[len("sqlite:///"):]
+            self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(path))
+
+    def test_inMemoryTemplate(self):
+        from goose import testing
+        self.assertRaises(ValueError, testing.TemplateDatabase,
+                          self.migrationDir, dbUrl)
+
+
+class TestSquash(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.migrationDir = os.path.join(self.tempDirectory, "migrations")
+        os.mkdir(self.migrationDir)
+        for name in ("create.sql", "track.sql", "good.sql"):
+            shutil.copy(os.path.join(core.ROOT, "testmigrations", name),
+                        self.migrationDir)
+        with open(os.path.join(self.migrationDir, "seed.sql"), "w") as f:
+            f.write("INSERT INTO Track (TrackId) VALUES (42);\n"
+                    "CREATE INDEX track_id ON Track (TrackId);\n"
+                    "DELIMITER $$\n"
+                    "CREATE TRIGGER track_copy AFTER INSERT ON Track BEGIN"
+                    " INSERT INTO test1 (testId) VALUES (NEW.TrackId); END$$\n"
+                    "DELIMITER ;\n")
+        with open(os.path.join(self.migrationDir, "index.yaml"), "w") as f:
+            f.write("# comments survive\nmigrations:\n - create.sql\n"
+                    " - track.sql\n - seed.sql\n - good.sql\n")
+        self.dsns = []
+
+    def tearDown(self):
+        for dsn in self.dsns:
+            models.engines.dispose(dsn)
+        shutil.rmtree(self.tempDirectory)
+
+    def migrator(self, name):
+        dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, name),)
+        self.dsns.append(dsn)
+        migrator = core.getMigrator(self.migrationDir)
+        migrator.verbose = False
+        migrator.connect(dsn)
+        models.init(migrator.engine)
+        return migrator
+
+    def test_squash(self):
+        existing = self.migrator("existing.db")
+        self.assertEqual(existing.migrate(toVersion=1), ["create.sql"])
+        self.assertEqual(core.squashMigrations(self.migrationDir, toVersion=3),
+                         ("baseline_0003.sql", 3))
+        with open(os.path.join(self.migrationDir, "index.yaml")) as f:
+            self.assertTrue(f.read().startswith("# comments survive\nbaseline:\n"))
+        # new migrations are still added to the end of the file
+        with open(os.path.join(self.migrationDir, "good2.sql"), "w") as f:
+            f.write("SELECT 1;\n")
+        with open(os.path.join(self.migrationDir, "index.yaml"), "a") as f:
+            f.write(" - good2.sql\n")
+        # the baseline stands in for the replaced files on new databases
+        os.remove(os.path.join(self.migrationDir, "create.sql"))
+        fresh = self.migrator("fresh.db")
+        self.assertEqual(fresh.baseline, ("baseline_0003.sql", 3))
+        self.assertEqual(fresh.migrate(), ["baseline_0003.sql", "good.sql",
+                                           "good2.sql"])
+        recorded = [(m.version, m.name) for m in fresh.session.query(
+                models.Migration).order_by(models.Migration.version)]
+        self.assertEqual(recorded, [(1, "create.sql"), (2, "track.sql"),
+                                    (3, "seed.sql"), (4, "good.sql"),
+                                    (5, "good2.sql")])
+        self.assertEqual(fresh.session.execute(
+                "SELECT TrackId FROM Track").fetchall(), [(42,)])
+        fresh.session.execute("INSERT INTO Track (TrackId) VALUES (7)")
+        self.assertEqual(fresh.session.execute(
+                "SELECT testId FROM test1").fetchall(), [(7,)])
+        # databases that already started carry on with the originals
+        existing = self.migrator("existing.db")
+        self.assertEqual(existing.migrate(), ["track.sql", "seed.sql", "good.sql",
+                                              "good2.sql"])
+
+    def test_partialMigrateSkipsBaseline(self):
+        core.squashMigrations(self.migrationDir, toVersion=3)
+        fresh = self.migrator("fresh.db")
+        self.assertEqual(fresh.migrate(toVersion=2), ["create.sql", "track.sql"])
+
+    def test_allMode(self):
+        core.squashMigrations(self.migrationDir, toVersion=2)
+        fresh = self.migrator("fresh.db")
+        fresh.transactionMode = "all"
+        self.assertEqual(fresh.migrate(),
+                         ["baseline_0002.sql", "seed.sql", "good.sql"])
+        self.assertEqual(fresh.getVersion(), 4)
+
+    def test_render(self):
+        core.squashMigrations(self.migrationDir, toVersion=2)
+        dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "render.db"),)
+        self.dsns.append(dsn)
+        out = StringIO.StringIO()
+        core.renderMigrations(self.migrationDir, dsn, init=True, out=out)
+        script = out.getvalue()
+        self.assertTrue("VALUES (1, 'create.sql', NULL, NULL," in script)
+        self.assertTrue("VALUES (2, 'track.sql', NULL, " in script)
+
+    def test_renderViaClient(self):
+        if not distutils.spawn.find_executable("sqlite3"):
+            self.skipTest("sqlite3 isn't installed")
+        core.squashMigrations(self.migrationDir, toVersion=2)
+        dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "render.db"),)
+        self.dsns.append(dsn)
+        self.assertEqual([name for version, name in core.renderMigrations(
+                    self.migrationDir, dsn, init=True, viaClient=True)],
+                         ["baseline_0002.sql", "seed.sql", "good.sql"])
+        self.assertEqual(self.migrator("render.db").getVersion(), 4)
+
+    def test_pgDumpKeepsSearchPath(self):
+        from goose import squash
+        canned = os.path.join(self.tempDirectory, "pg_dump.sql")
+        with open(canned, "w") as f:
+            f.write("SET statement_timeout = 0;\n"
+                    "SELECT pg_catalog.set_config('search_path', '', false);\n"
+                    "CREATE TABLE public.track (trackid integer);\n")
+        dumpCommand = squash.dumpCommand
+        squash.dumpCommand = lambda dsn: (["cat", canned], dict(os.environ))
+        try:
+            out = StringIO.StringIO()
+            squash.dump("postgresql://localhost/scratch", out)
+        finally:
+            squash.dumpCommand = dumpCommand
+        self.assertEqual(out.getvalue(),
+                         "SET statement_timeout = 0;\n"
+                         "CREATE TABLE public.track (trackid integer);\n")
+
+    def test_main(self):
+        options = core.main(["-m", self.migrationDir, "squash", "-t", "2",
+                             "-o", "base.sql"])
+        self.assertEqual(options.subCommand, "squash")
+        self.assertEqual(self.migrator("fresh.db").baseline, ("base.sql", 2))
+
+
+class TestIncludes(unittest.TestCase):
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.migrationDir = os.path.join(self.tempDirectory, "migrations")
+        os.makedirs(os.path.join(self.migrationDir, "releases"))
+        for name in ("create.sql", "track.sql", "good.sql"):
+            shutil.copy(os.path.join(core.ROOT, "testmigrations", name),
+                        self.migrationDir)
+        with open(os.path.join(self.migrationDir, "releases", "1.yaml"), "w") as f:
+            f.write("migrations:\n - create.sql\n - track.sql\n")
+        with open(os.path.join(self.migrationDir, "index.yaml"), "w") as f:
+            f.write("includes:\n - {index: releases/1.yaml, count: 2}\n"
+                    "migrations:\n - good.sql\n")
+        self.dsn = "sqlite:///%s"%(os.path.join(self.tempDirectory, "test.db"),)
+
+    def tearDown(self):
+        models.engines.dispose(self.dsn)
+        shutil.rmtree(self.tempDirectory)
+
+    def migrator(self, directory=None):
+        migrator = core.getMigrator(directory or self.migrationDir)
+        migrator.verbose = False
+        migrator.connect(self.dsn)
+        models.init(migrator.engine)
+        return migrator
+
+    def test_appliedIncludesAreNotRead(self):
+        migrator = self.migrator()
+        self.assertEqual(migrator.migrate(),
+                         ["create.sql", "track.sql", "good.sql"])
+        self.assertEqual(migrator.migrations.loaded(), ["releases/1.yaml"])
+        migrator.close()
+        with open(os.path.join(self.migrationDir, "releases", "1.yaml"), "w") as f:
+            f.write("not: [an index")
+        os.remove(os.path.join(self.migrationDir, "create.sql"))
+        migrator = self.migrator()
+        plan = migrator.plan()
+        self.assertTrue(plan.isConsistent())
+        self.assertEqual(plan.pending, [])
+        self.assertEqual(migrator.migrate(), [])
+        self.assertEqual(migrator.migrations.loaded(), [])
+        migrator.close()
+
+    def test_missingFileInPendingInclude(self):
+        os.remove(os.path.join(self.migrationDir, "track.sql"))
+        migrator = self.migrator()
+        self.assertRaises(ValueError, migrator.migrate)
+        migrator.close()
+
+    def test_compile(self):
+        bundlePath = core.compileMigrations(self.migrationDir)
+        migrator = self.migrator(bundlePath)
+        self.assertEqual(migrator.migrate(),
+                         ["create.sql", "track.sql", "good.sql"])
+        self.assertEqual(migrator.dependencies["good.sql"], ["track.sql"])
+        migrator.close()
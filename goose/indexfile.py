@@ -0,0 +1,368 @@
+"""indexfile.py
+
+Loads index files quickly, even when they list thousands of migrations.
+
+* YAML is parsed with libyaml's C loader when PyYAML was built with it,
+  and PyYAML is only imported when an index actually has to be parsed.
+* Parsed indexes are cached on disk, keyed on the index file's path,
+  size, modification time and inode, so an unchanged index is read
+  back with the json module instead of being parsed again.  The cache
+  lives in $GOOSE_CACHE_DIR, or $XDG_CACHE_HOME/goose, or ~/.cache/goose;
+  if it can't be written goose simply carries on without it.  Only the
+  most recently parsed indexes are kept, see `pruneCache`.
+* `missingFiles` checks that migration files exist with one directory
+  listing per directory instead of one stat per migration.
+* An index can be split into included indexes, say one per release,
+  that are only read when one of their versions is needed; see
+  `MigrationList`.
+
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+
+
+CACHE_FORMAT = 1
+
+# how many parsed indexes the cache keeps
+CACHE_ENTRIES = 64
+
+
+def extension(path):
+    name, ext = os.path.splitext(path)
+    ext = ext.lower()
+    return ext
+
+
+def yamlLoader():
+    import yaml
+    return getattr(yaml, "CSafeLoader", None) or yaml.SafeLoader
+
+
+def parseIndex(indexFilepath):
+    ext = extension(indexFilepath)
+    with open(indexFilepath, "r") as f:
+        if ext == ".yaml":
+            # imported here so that reading a cached index doesn't pay
+            # for it; without yaml only json index files will work.
+            import yaml
+            return yaml.load(f, Loader=yamlLoader())
+        elif ext == ".json":
+            return json.load(f)
+    raise ValueError("Unsupported index file format: %s\n"
+                     "Please use 'json' or 'yaml'."%(ext,))
+
+
+def cacheDirectory():
+    directory = os.environ.get("GOOSE_CACHE_DIR")
+    if directory:
+        return directory
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "goose")
+
+
+def cachePath(indexFilepath):
+    key = hashlib.sha1(os.path.abspath(indexFilepath)).hexdigest()
+    return os.path.join(cacheDirectory(), key + ".json")
+
+
+def statKey(path):
+    stat = os.stat(path)
+    return [CACHE_FORMAT, stat.st_size, stat.st_mtime, stat.st_ino]
+
+
+def readCache(path, key):
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if cached.get("key") != key:
+        return None
+    return cached["index"]
+
+
+def writeCache(path, key, index):
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        partialPath = "%s.%s.partial"%(path, os.getpid())
+        with open(partialPath, "w") as f:
+            json.dump({"key": key, "index": index}, f)
+        os.rename(partialPath, path)
+    except (IOError, OSError):
+        return
+    pruneCache(directory)
+
+
+def pruneCache(directory, keep=None):
+    """
+    Removes all but the ``keep`` most recently written entries, so
+    that indexes in temporary directories don't pile up in the cache.
+    """
+    if keep is None:
+        keep = CACHE_ENTRIES
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.endswith(".json")]
+        if len(paths) <= keep:
+            return
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[keep:]:
+            os.remove(path)
+    except (IOError, OSError):
+        # another goose got there first
+        pass
+
+
+def loadIndex(indexFilepath, useCache=True):
+    """Returns the parsed contents of an index file.
+    """
+    if not useCache:
+        return parseIndex(indexFilepath)
+    key = statKey(indexFilepath)
+    path = cachePath(indexFilepath)
+    index = readCache(path, key)
+    if index is None:
+        index = parseIndex(indexFilepath)
+        writeCache(path, key, index)
+    return index
+
+
+def migrationEntries(entries, previous=None, external=False):
+    """Splits the ``migrations`` of an index into names and dependencies.
+
+    An entry is either a file name or a mapping like::
+
+      - name: backfill_orders.sql
+        depends: [create_orders.sql]
+
+    An entry without ``depends`` depends on the entry before it, so a
+    plain list of names is applied strictly in order.  Dependencies
+    have to come earlier in the index.  Returns the list of names and
+    a dict from each name to the names it depends on.
+
+    ``previous`` is the name of the migration before the first entry,
+    if there is one, and ``external`` allows dependencies on names that
+    aren't in ``entries``; both are for included indexes, which don't
+    know the rest of the index.
+    """
+    names = []
+    dependencies = {}
+    if previous is not None:
+        names = [previous]
+    for entry in entries:
+        depends = None
+        if isinstance(entry, dict):
+            if "name" not in entry:
+                raise ValueError("Index entry without a name: %r"%(entry,))
+            name = entry["name"]
+            depends = entry.get("depends")
+        else:
+            name = entry
+        if depends is None:
+            depends = names[-1:]
+        elif isinstance(depends, basestring):
+            depends = [depends]
+        for dependency in depends:
+            if dependency not in dependencies and not external:
+                raise ValueError("%s depends on %s, which doesn't come before"
+                                 " it in the index"%(name, dependency))
+        names.append(name)
+        dependencies[name] = list(depends)
+    if previous is not None:
+        names = names[1:]
+    return names, dependencies
+
+
+def baselineEntry(index, migrations):
+    """The index's baseline, see `goose.squash`, as (name, version).
+
+    Returns None when the index doesn't have one.
+    """
+    baseline = index.get("baseline")
+    if baseline is None:
+        return None
+    if not isinstance(baseline, dict) or "name" not in baseline:
+        raise ValueError("The baseline needs a name and a version: %r"%(baseline,))
+    version = baseline.get("version")
+    if not isinstance(version, int) or not 0 < version <= len(migrations):
+        raise ValueError("The baseline's version has to be one of the"
+                         " index's versions, not %r"%(version,))
+    return baseline["name"], version
+
+
+def followsPrevious(entries):
+    """Whether the first of ``entries`` depends on the entry before it."""
+    return bool(entries) and (not isinstance(entries[0], dict) or
+                              entries[0].get("depends") is None)
+
+
+class Part(object):
+    """A run of versions in a `MigrationList`."""
+    def __init__(self, start, count, path=None, names=None):
+        # versions start + 1 to start + count
+        self.start = start
+        self.count = count
+        self.path = path
+        self.names = names
+        # whether the first migration depends on the one before it,
+        # which may not have been read yet
+        self.followsPrevious = False
+
+    def versions(self):
+        return range(self.start + 1, self.start + self.count + 1)
+
+
+class MigrationList(object):
+    """
+    The migration names of an index that includes other indexes::
+
+      includes:
+        - index: releases/2011.yaml
+          count: 412
+        - index: releases/2012.yaml
+          count: 130
+      migrations:
+        - add_invoices.sql
+
+    The included indexes' migrations come first, in the order they're
+    included, followed by the index's own.  Each include says how many
+    migrations it has, so which versions it holds is known without
+    reading it, and it's only read, and its files checked by
+    ``check(start, names)``, once one of those versions is needed.
+    Names are relative to the migration directory, like any other
+    index's, so splitting an index doesn't rename anything.
+
+    Otherwise it behaves like the list of names, which reads every
+    include it hasn't read yet; `versionsToCheck` is what
+    `goose.planner` uses to skip the ones that don't matter.
+    """
+    def __init__(self, directory, index, check=None):
+        self.directory = directory
+        self.check = check
+        self.parts = []
+        self.dependencies = {}
+        self.lock = threading.RLock()
+        start = 0
+        for include in index.get("includes") or []:
+            if (not isinstance(include, dict) or "index" not in include or
+                not isinstance(include.get("count"), int) or
+                include["count"] < 0):
+                raise ValueError("An include needs an index and the number of"
+                                 " migrations in it: %r"%(include,))
+            self.parts.append(Part(start, include["count"], include["index"]))
+            start += include["count"]
+        entries = index.get("migrations") or []
+        names, dependencies = migrationEntries(entries, external=True)
+        self.parts.append(Part(start, len(names), names=names))
+        self.parts[-1].followsPrevious = followsPrevious(entries)
+        self.dependencies.update(dependencies)
+        self.starts = [part.start for part in self.parts]
+
+    def __len__(self):
+        last = self.parts[-1]
+        return last.start + last.count
+
+    def partFor(self, position):
+        return self.parts[bisect.bisect_right(self.starts, position) - 1]
+
+    def load(self, part):
+        """The names in ``part``, reading its index if it hasn't been."""
+        with self.lock:
+            if part.names is not None:
+                return part.names
+            path = os.path.join(self.directory, part.path)
+            index = loadIndex(path)
+            if "includes" in index:
+                raise ValueError("%s can't include other indexes, only the top"
+                                 " level index can"%(part.path,))
+            position = self.parts.index(part)
+            before = [p for p in self.parts[:position] if p.count]
+            after = [p for p in self.parts[position + 1:] if p.count]
+            previous = None
+            if before and before[-1].names is not None:
+                previous = before[-1].names[-1]
+            entries = index.get("migrations") or []
+            names, dependencies = migrationEntries(entries, previous,
+                                                   external=True)
+            if len(names) != part.count:
+                raise ValueError("%s lists %s migrations but the index says it"
+                                 " has %s"%(part.path, len(names), part.count))
+            if self.check is not None:
+                self.check(part.start, names)
+            self.dependencies.update(dependencies)
+            part.names = names
+            part.followsPrevious = followsPrevious(entries)
+            if (names and after and after[0].names is not None and
+                after[0].followsPrevious):
+                self.dependencies[after[0].names[0]] = [names[-1]]
+            return names
+
+    def loaded(self):
+        """Paths of the included indexes that have been read."""
+        return [part.path for part in self.parts
+                if part.path is not None and part.names is not None]
+
+    def loadedNames(self):
+        """(version, name) of every migration known without reading more."""
+        return [(part.start + i, name) for part in self.parts
+                if part.names is not None
+                for i, name in enumerate(part.names, 1)]
+
+    def versionsToCheck(self, applied):
+        """
+        (version, name) of the migrations a plan has to look at, given
+        the versions that have been ``applied``.  Includes whose every
+        version has been applied aren't read: those migrations were
+        checked when they were applied and aren't needed again.
+        """
+        for part in self.parts:
+            if part.names is None and all(version in applied
+                                          for version in part.versions()):
+                continue
+            for version, name in zip(part.versions(), self.load(part)):
+                yield version, name
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[position] for position in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("migration list index out of range")
+        part = self.partFor(key)
+        return self.load(part)[key - part.start]
+
+    def __iter__(self):
+        for part in self.parts:
+            for name in self.load(part):
+                yield name
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def missingFiles(directory, migrations):
+    """Names in ``migrations`` that don't exist relative to ``directory``.
+    """
+    listings = {}
+    missing = []
+    for migration in migrations:
+        subdirectory, filename = os.path.split(os.path.join(directory, migration))
+        if subdirectory not in listings:
+            try:
+                listings[subdirectory] = set(
+                    os.listdir(subdirectory or os.curdir))
+            except OSError:
+                listings[subdirectory] = set()
+        if filename not in listings[subdirectory]:
+            missing.append(migration)
+    return missing
@@ -0,0 +1,130 @@
+"""instrumentation.py
+
+Hooks for finding out where the time in a migration run goes.
+
+Subclass `Instrumentation`, override the callbacks you care about and
+add an instance to a migrator::
+
+  class Progress(instrumentation.Instrumentation):
+      def afterMigration(self, migrationName, version, elapsed, statementCount):
+          print "%s took %.1fs"%(migrationName, elapsed)
+
+  migrator.instruments.append(Progress())
+
+`SlowStatementReport` is a ready made instrument that remembers the N
+slowest statements of a run; it's what ``goose migrate --slowest N``
+prints.  `goose.events` has instruments that report a run as JSON
+lines and as Prometheus metrics.  A migrator with no instruments
+doesn't time individual statements at all.
+
+"""
+import heapq
+import threading
+
+
+class Instrumentation(object):
+    """Callbacks made while migrations run.  They all do nothing.
+
+    ``statement`` is a `goose.tokenizer.Statement`; its ``offset`` is
+    where it starts in the migration file.  ``rowcount`` is whatever the
+    database reported, which may be -1 or None for statements that
+    don't touch rows.
+
+    ``migrations`` are the (version, name) pairs a run is about to
+    apply and ``error`` the exception a migration or run failed with,
+    or None.  Migrations applied in parallel (``migrate --jobs``) make
+    their callbacks from several threads at once.
+    """
+
+    def beforeRun(self, migrations):
+        pass
+
+    def afterRun(self, elapsed, error):
+        pass
+
+    def beforeMigration(self, migrationName, version):
+        pass
+
+    def afterMigration(self, migrationName, version, elapsed, statementCount):
+        pass
+
+    def migrationFailed(self, migrationName, version, elapsed, error):
+        pass
+
+    def beforeStatement(self, migrationName, version, statement):
+        pass
+
+    def afterStatement(self, migrationName, version, statement, elapsed,
+                       rowcount):
+        pass
+
+
+class Instruments(Instrumentation):
+    """Passes every callback on to each of a list of instruments."""
+    def __init__(self, instruments):
+        self.instruments = list(instruments)
+
+    def beforeRun(self, *args):
+        for instrument in self.instruments:
+            instrument.beforeRun(*args)
+
+    def afterRun(self, *args):
+        for instrument in self.instruments:
+            instrument.afterRun(*args)
+
+    def beforeMigration(self, *args):
+        for instrument in self.instruments:
+            instrument.beforeMigration(*args)
+
+    def afterMigration(self, *args):
+        for instrument in self.instruments:
+            instrument.afterMigration(*args)
+
+    def migrationFailed(self, *args):
+        for instrument in self.instruments:
+            instrument.migrationFailed(*args)
+
+    def beforeStatement(self, *args):
+        for instrument in self.instruments:
+            instrument.beforeStatement(*args)
+
+    def afterStatement(self, *args):
+        for instrument in self.instruments:
+            instrument.afterStatement(*args)
+
+
+class SlowStatementReport(Instrumentation):
+    """Keeps the ``size`` slowest statements seen."""
+    def __init__(self, size=10, width=60):
+        self.size = size
+        self.width = width
+        self.slowest = []
+        self.lock = threading.Lock()
+
+    def afterStatement(self, migrationName, version, statement, elapsed,
+                       rowcount):
+        entry = (elapsed, migrationName, getattr(statement, "offset", None),
+                 rowcount, statement)
+        with self.lock:
+            if len(self.slowest) < self.size:
+                heapq.heappush(self.slowest, entry)
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def entries(self):
+        """``(elapsed, migrationName, offset, rowcount, statement)``,
+        slowest first.
+        """
+        with self.lock:
+            return sorted(self.slowest, reverse=True)
+
+    def report(self):
+        lines = ["%-8s  %-7s  %-24s  %s"%("Seconds", "Rows", "Migration@Offset",
+                                         "Statement")]
+        for elapsed, migrationName, offset, rowcount, statement in self.entries():
+            text = " ".join(statement.split())
+            if len(text) > self.width:
+                text = text[:self.width - 3] + "..."
+            lines.append("%-8.3f  %-7s  %-24s  %s"%(
+                    elapsed, rowcount, "%s@%s"%(migrationName, offset), text))
+        return lines
@@ -0,0 +1,39 @@
+"""lazy.py
+
+Defers expensive imports until they are actually used.
+
+`goose.models` pulls in SQLAlchemy and sets up its mappers, which takes
+longer than everything else goose does before connecting put together.
+Modules that only need it once a database is involved hold a
+`LazyModule` instead::
+
+  models = lazy.LazyModule("goose.models")
+
+and the real module is imported the first time one of its attributes
+is looked up.
+
+"""
+import sys
+
+
+class LazyModule(object):
+    """Stands in for a module until one of its attributes is used."""
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+
+    def _load(self):
+        module = sys.modules.get(self._name)
+        if module is None:
+            __import__(self._name)
+            module = sys.modules[self._name]
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return "<LazyModule '%s'>"%(self._name,)
+
@@ -3,47 +3,99 @@ with the databases migration table.
 
 """
 import datetime
+import threading
 
 import sqlalchemy
 from sqlalchemy import create_engine
 from sqlalchemy import func
-from sqlalchemy import (Column, DateTime, Integer,
+from sqlalchemy import select
+from sqlalchemy import (Column, DateTime, Float, Integer,
                         #ForeignKey,
                         MetaData,
                         #Sequence,
                         String, Table)
+from sqlalchemy.engine import reflection
 
 OperationalError = sqlalchemy.exc.OperationalError
 
+
+def autocommitText(sql):
+    """``sql`` as a statement that's committed once it has run, whatever
+    kind of statement it is, when it's not run in a transaction.
+    """
+    return sqlalchemy.text(sql).execution_options(autocommit=True)
+
+
+def isInMemory(dsn):
+    return dsn.startswith("sqlite") and (":memory:" in dsn or
+                                         dsn.rstrip("/").endswith(":"))
+
+
 max = func.max
 
 metadata = MetaData()
 
+# Version of the bookkeeping tables below.  Version 1 was migration_info
+# without indexes, checksum, duration or statement_count and without
+# the migration_schema table; `upgrade` brings it up to date.
+SCHEMA_VERSION = 2
+
 migration_table = Table("migration_info", metadata,
     Column("migration_id", Integer, primary_key=True),
-    Column("version", Integer),
-    Column("name", String(256)),
+    Column("version", Integer, index=True),
+    Column("name", String(256), index=True),
     Column("migration_date", DateTime, default=func.now(), onupdate=func.now()),
+    # added in schema version 2
+    Column("checksum", String(40)),
+    Column("duration", Float),
+    Column("statement_count", Integer),
+)
+
+V2_COLUMNS = ("checksum", "duration", "statement_count")
+
+schema_table = Table("migration_schema", metadata,
+    Column("version", Integer, primary_key=True),
+)
+
+# How far a migration run without a transaction got, see
+# `saveProgress`.  `init` creates it like the other tables, databases
+# set up by an older goose get it the first time it's needed, so it
+# doesn't change the schema version.
+progress_table = Table("migration_progress", metadata,
+    Column("name", String(256), primary_key=True),
+    Column("checksum", String(40)),
+    Column("batch_size", Integer),
+    Column("statements", Integer),
+    Column("updated", DateTime),
 )
 
 class Migration(object):
-    def __init__(self, version, name, migrationDate=None):
+    def __init__(self, version, name, migrationDate=None,
+                 checksum=None, duration=None, statementCount=None):
         self.version = version
         self.name = name
         if migrationDate is None:
             migrationDate = datetime.datetime.now()
         self.migrationDate = migrationDate
+        self.checksum = checksum
+        self.duration = duration
+        self.statementCount = statementCount
 
     def __repr__(self):
         return "<Migration('%s', '%s', '%s')>"%(
             self.version, self.name, self.migrationDate)
 
 
-from sqlalchemy.orm import mapper
+from sqlalchemy.orm import deferred, mapper
 
 
+# The version 2 columns are deferred so that loading Migrations from a
+# version 1 table (before `goose init --upgrade`) still works.
 mapper(Migration, migration_table,
-       properties={"migrationDate":migration_table.c.migration_date}
+       properties={"migrationDate":migration_table.c.migration_date,
+                   "checksum":deferred(migration_table.c.checksum),
+                   "duration":deferred(migration_table.c.duration),
+                   "statementCount":deferred(migration_table.c.statement_count)}
        )
 
 
@@ -54,15 +106,209 @@ Session = sessionmaker(autocommit=True,
                        autoflush=False)
 
 
-def init():
-    metadata.create_all()
+def init(bind=None):
+    """
+    Creates the bookkeeping tables in ``bind``, or in whatever
+    `connect` last bound ``metadata`` to.
+    """
+    bind = bind or metadata.bind
+    if bind is None:
+        raise ValueError("Nothing to create the tables in: pass the engine,"
+                         " e.g. models.init(migrator.engine)")
+    existing = bind.has_table(migration_table.name)
+    metadata.create_all(bind=bind)
+    if not existing:
+        bind.execute(schema_table.insert(), version=SCHEMA_VERSION)
+
+
+def schemaVersion(bind):
+    """Version of the bookkeeping tables, or None if there aren't any.
+    """
+    if not bind.has_table(migration_table.name):
+        return None
+    if not bind.has_table(schema_table.name):
+        return 1
+    return bind.execute(select([func.max(schema_table.c.version)])).scalar() or 1
+
+
+def upgrade(bind=None):
+    """Brings the bookkeeping tables up to SCHEMA_VERSION.
+
+    Only adds nullable columns and indexes, which doesn't rewrite or
+    block migration_info (indexes are built CONCURRENTLY on PostgreSQL)
+    so it's safe to run while other goose processes are using it.
+    """
+    bind = bind or metadata.bind
+    current = schemaVersion(bind)
+    if current is None:
+        init(bind)
+        return SCHEMA_VERSION
+    if current >= SCHEMA_VERSION:
+        return current
+    inspector = reflection.Inspector.from_engine(bind)
+    columns = set(c["name"] for c in inspector.get_columns(migration_table.name))
+    for name in V2_COLUMNS:
+        if name not in columns:
+            column = migration_table.c[name]
+            bind.execute("ALTER TABLE %s ADD COLUMN %s %s"%(
+                    migration_table.name, name,
+                    column.type.compile(dialect=bind.dialect)))
+    indexes = set(i["name"] for i in inspector.get_indexes(migration_table.name))
+    for index in migration_table.indexes:
+        if index.name in indexes:
+            continue
+        if bind.dialect.name == "postgresql":
+            executeOutsideTransaction(bind, "CREATE INDEX CONCURRENTLY %s ON %s (%s)"%(
+                    index.name, migration_table.name,
+                    ", ".join(c.name for c in index.columns)))
+        else:
+            index.create(bind)
+    schema_table.create(bind, checkfirst=True)
+    bind.execute(schema_table.insert(), version=SCHEMA_VERSION)
+    return SCHEMA_VERSION
+
+
+def executeOutsideTransaction(bind, statement):
+    """Runs a statement PostgreSQL refuses to run in a transaction block.
+    """
+    raw = bind.raw_connection()
+    try:
+        connection = raw.connection
+        if hasattr(connection, "set_isolation_level"):
+            # psycopg2
+            connection.set_isolation_level(0)
+        else:
+            connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+    finally:
+        # don't hand a connection in autocommit mode back to the pool
+        raw.invalidate()
+
+
+def migrationValues(version, name, checksum=None, duration=None,
+                    statementCount=None, schemaVersion=SCHEMA_VERSION):
+    values = {"version": version,
+              "name": name,
+              "migration_date": datetime.datetime.now()}
+    if schemaVersion >= 2:
+        values.update(checksum=checksum, duration=duration,
+                      statement_count=statementCount)
+    return values
+
+
+def recordMigration(connection, version, name, checksum=None, duration=None,
+                    statementCount=None, schemaVersion=SCHEMA_VERSION):
+    """Inserts a migration_info row for an applied migration.
+    """
+    connection.execute(migration_table.insert(),
+                       migrationValues(version, name, checksum, duration,
+                                       statementCount, schemaVersion))
+
+
+def recordMigrations(connection, records):
+    """Inserts the migration_info rows for many migrations at once.
+
+    ``records`` are dicts of recordMigration's keyword arguments.
+    """
+    if records:
+        connection.execute(migration_table.insert(),
+                           [migrationValues(**record) for record in records])
+
+
+def createProgressTable(bind):
+    progress_table.create(bind, checkfirst=True)
+
+
+def loadProgress(connection, name):
+    """(checksum, batch_size, statements) saved for a migration, or None.
+    """
+    row = connection.execute(select(
+            [progress_table.c.checksum, progress_table.c.batch_size,
+             progress_table.c.statements],
+            progress_table.c.name == name)).fetchone()
+    if row is None:
+        return None
+    return tuple(row)
+
+
+def saveProgress(connection, name, checksum, batchSize, statements):
+    """Records that the first ``statements`` statements of a migration
+    have been committed.
+    """
+    values = {"checksum": checksum, "batch_size": batchSize,
+              "statements": statements,
+              "updated": datetime.datetime.now()}
+    result = connection.execute(progress_table.update(
+            progress_table.c.name == name), values)
+    if not result.rowcount:
+        values["name"] = name
+        connection.execute(progress_table.insert(), values)
+
+
+def clearProgress(connection, name):
+    connection.execute(progress_table.delete(progress_table.c.name == name))
+
+
+class EngineRegistry(object):
+    """
+    Engines by DSN, so connecting to a database again reuses its
+    connection pool instead of building a new engine every time.
+
+    Pool options (pool_size, max_overflow, pool_timeout, pool_recycle,
+    ...) are passed on to create_engine, and an engine is only shared
+    by callers asking for the same options.  In-memory SQLite engines
+    are never shared since each of them is a database of its own.
+    """
+    def __init__(self):
+        self.engines = {}
+        self.lock = threading.Lock()
+
+    def engine(self, dsn, echo=False, **poolOptions):
+        if isInMemory(dsn):
+            return create_engine(dsn, echo=echo, **poolOptions)
+        key = (dsn, bool(echo), tuple(sorted(poolOptions.items())))
+        with self.lock:
+            engine = self.engines.get(key)
+            if engine is None:
+                engine = create_engine(dsn, echo=echo, **poolOptions)
+                self.engines[key] = engine
+        return engine
+
+    def dispose(self, dsn=None):
+        """
+        Closes the pooled connections of the engines for ``dsn``, or of
+        every engine, and forgets them.  Returns how many were disposed.
+        """
+        with self.lock:
+            keys = [key for key in self.engines
+                    if dsn is None or key[0] == dsn]
+            disposed = [self.engines.pop(key) for key in keys]
+        for engine in disposed:
+            engine.dispose()
+        return len(disposed)
+
+    def __len__(self):
+        return len(self.engines)
+
+
+engines = EngineRegistry()
+
 
+def connect(dsn, echo=False, **poolOptions):
+    """
+    Returns a new session on ``dsn``'s engine from `engines`.
 
-def connect(dsn):
-    engine = create_engine(dsn, echo=True)
+    ``metadata`` and ``Session`` are bound to the engine as well, for
+    callers relying on them; DatabaseMigrator doesn't.
+    """
+    engine = engines.engine(dsn, echo, **poolOptions)
     metadata.bind = engine
     Session.configure(bind=engine)
-    session = Session()
+    # bind explicitly as well so sessions created concurrently in
+    # other threads can't pick up each other's engine
+    session = Session(bind=engine)
     return session #, metadata, engine
 
 
@@ -0,0 +1,84 @@
+"""planner.py
+
+Works out which migrations a database still needs.
+
+Rather than trusting ``max(version)`` the planner loads every
+``(version, name)`` pair recorded in migration_info and compares it
+with the index, so migrations that were skipped, applied out of order
+or renamed in the index are all noticed.
+
+"""
+
+
+class MigrationPlan(object):
+    """Compares the applied migrations with the index.
+
+    ``migrations`` is the ordered list of migration names from the index
+    (version N is ``migrations[N-1]``) and ``applied`` is an iterable of
+    ``(version, name)`` pairs from migration_info.  If ``migrations``
+    has a ``versionsToCheck(applied)`` method, like
+    goose.indexfile.MigrationList, only the ``(version, name)`` pairs it
+    returns are compared.
+
+    pending
+        ``(version, name)`` of every migration in the index that hasn't
+        been applied, in order.
+    gaps
+        the pending migrations that come before a migration that has
+        already been applied.
+    mismatched
+        ``(version, indexName, appliedName)`` for versions that were
+        applied under a different name than the index now gives them.
+    unknown
+        ``(version, name)`` of applied versions that aren't in the index.
+    """
+
+    def __init__(self, migrations, applied):
+        self.applied = dict(applied)
+        self.highest = max(self.applied) if self.applied else None
+        self.pending = []
+        self.mismatched = []
+        if hasattr(migrations, "versionsToCheck"):
+            versions = migrations.versionsToCheck(self.applied)
+        else:
+            versions = enumerate(migrations, 1)
+        for version, name in versions:
+            appliedName = self.applied.get(version)
+            if appliedName is None and version not in self.applied:
+                self.pending.append((version, name))
+            elif appliedName != name:
+                self.mismatched.append((version, name, appliedName))
+        self.gaps = [(version, name) for version, name in self.pending
+                     if self.highest is not None and version < self.highest]
+        self.unknown = sorted((version, name)
+                              for version, name in self.applied.iteritems()
+                              if not 0 < version <= len(migrations))
+
+    def isApplied(self, version):
+        return version in self.applied
+
+    def pendingUpTo(self, toVersion=None):
+        """Pending migrations with versions up to and including toVersion.
+        """
+        if toVersion is None:
+            return list(self.pending)
+        return [(version, name) for version, name in self.pending
+                if version <= toVersion]
+
+    def isConsistent(self):
+        return not (self.mismatched or self.unknown)
+
+    def report(self):
+        """Human readable lines describing anything unexpected.
+        """
+        lines = []
+        for version, name in self.gaps:
+            lines.append("Version %s (%s) was skipped: later versions have"
+                         " already been applied."%(version, name))
+        for version, indexName, appliedName in self.mismatched:
+            lines.append("Version %s was applied as %s but the index now"
+                         " lists %s."%(version, appliedName, indexName))
+        for version, name in self.unknown:
+            lines.append("Version %s (%s) has been applied but isn't in the"
+                         " index."%(version, name))
+        return lines
@@ -0,0 +1,158 @@
+"""profiling.py
+
+Finds out how much of a migration's time is spent in goose itself.
+
+``goose --profile DIR migrate`` applies every migration under cProfile,
+writes a pstats file per migration to DIR (``0002-track.sql.pstats``,
+for ``python -m pstats`` or snakeviz) and prints a summary::
+
+  Version  Migration             Wall    Driver  Goose   CPU     Memory
+  2        track.sql             12.41   11.93   0.48    0.61    +3.2MB
+
+``Driver`` is the time spent in the database driver's execute calls,
+that is waiting for the database (and for SQLite the database's own
+work, since it runs in goose's process); ``Goose`` is everything else:
+reading and splitting the file, batching, bookkeeping and output.
+``CPU`` is the process' user and system time.  ``Memory`` is the peak
+of the memory tracemalloc traced while the migration ran where
+tracemalloc exists, and otherwise how much the process' peak resident
+size grew.  Profiling slows goose's own code down, not the database,
+so Goose is an overestimate.
+
+CPU and memory can only be measured for the whole process, so with a
+profiler migrations are applied one at a time whatever ``--jobs``
+says; otherwise each migration's figures would include whatever ran
+next to it.
+
+"""
+import cProfile
+import os
+import pstats
+import re
+import resource
+import sys
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# SQLAlchemy calls the DB-API cursor's execute from these, whatever the
+# database
+DRIVER_FUNCTIONS = ("do_execute", "do_executemany")
+
+
+def peakResidentBytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+def cpuSeconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def driverSeconds(stats):
+    """Cumulative time spent in SQLAlchemy's execute calls."""
+    total = 0.0
+    for (filename, line, function), entry in stats.stats.iteritems():
+        if function in DRIVER_FUNCTIONS and "sqlalchemy" in filename:
+            total += entry[3]
+    return total
+
+
+def formatBytes(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return "%+.1f%s"%(size, unit)
+        size /= 1024.0
+    return "%+.1fGB"%(size,)
+
+
+class Profile(object):
+    """What `Profiler` measured for one migration."""
+    def __init__(self, version, migrationName, path, wall, driver, cpu, memory):
+        self.version = version
+        self.migrationName = migrationName
+        self.path = path
+        self.wall = wall
+        self.driver = driver
+        self.cpu = cpu
+        self.memory = memory
+
+    @property
+    def goose(self):
+        return max(self.wall - self.driver, 0.0)
+
+
+class Profiler(object):
+    """Profiles calls that apply a migration, see `call`."""
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def statsPath(self, version, migrationName):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", migrationName)
+        return os.path.join(self.directory, "%04d-%s.pstats"%(version, name))
+
+    def startMemory(self):
+        if tracemalloc is None:
+            return peakResidentBytes()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def memoryUsed(self, start):
+        if tracemalloc is None:
+            return peakResidentBytes() - start
+        return tracemalloc.get_traced_memory()[1] - start
+
+    def call(self, migrationName, version, function, *args):
+        """
+        Calls function(*args), which applies a migration, under the
+        profiler and returns what it returns.  The migration's stats are
+        written even if it fails.
+        """
+        profile = cProfile.Profile()
+        memory = self.startMemory()
+        cpu = cpuSeconds()
+        start = time.time()
+        profile.enable()
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+            wall = time.time() - start
+            cpu = cpuSeconds() - cpu
+            memory = self.memoryUsed(memory)
+            path = self.statsPath(version, migrationName)
+            profile.dump_stats(path)
+            driver = driverSeconds(pstats.Stats(profile))
+            with self.lock:
+                self.profiles.append(Profile(version, migrationName, path,
+                                             wall, driver, cpu, memory))
+
+    def report(self):
+        lines = ["%-7s  %-20s  %-6s  %-6s  %-6s  %-6s  %s"%(
+                "Version", "Migration", "Wall", "Driver", "Goose", "CPU",
+                "Memory")]
+        with self.lock:
+            profiles = sorted(self.profiles,
+                              key=lambda profile: profile.version)
+        for profile in profiles:
+            lines.append("%-7s  %-20s  %-6.2f  %-6.2f  %-6.2f  %-6.2f  %s"%(
+                    profile.version, profile.migrationName, profile.wall,
+                    profile.driver, profile.goose, profile.cpu,
+                    formatBytes(profile.memory)))
+        lines.append("pstats files are in %s"%(self.directory,))
+        return lines
@@ -0,0 +1,127 @@
+"""pymigration.py
+
+Python migrations, for data transforms SQL can't express.
+
+A migration whose name ends in ``.py`` is loaded into goose's own
+process and its ``forward`` function is called with a
+`MigrationContext`::
+
+  def forward(migration):
+      for rows in migration.iterChunks("SELECT id, name FROM users"):
+          migration.writeMany("UPDATE users SET slug = :slug WHERE id = :id",
+                              [(slugify(name), id) for id, name in rows])
+
+Everything the migration does goes through the connection goose gives
+it, so it runs inside the same transaction as it would for a SQL file
+(see ``migrate --transaction-mode``) and is recorded in migration_info
+the same way.  `iterChunks` reads with a server side cursor where the
+driver has one (psycopg2), so only one chunk of rows is in memory at a
+time; `writeMany` sends a whole chunk with a single executemany.
+Without a transaction the writes would commit, and so close, the
+cursor being read from, which is why Python migrations can't be run
+with ``--transaction-mode none``.
+
+Statements use SQLAlchemy's ``:name`` bind parameters.  Rows passed to
+`writeMany` can be dicts, or sequences whose values are given in the
+order the parameters appear in the statement.
+
+"""
+import re
+import time
+import types
+
+from goose import lazy
+from goose import tokenizer
+
+sqlalchemy = lazy.LazyModule("sqlalchemy")
+
+
+CHUNK_SIZE = 1000
+
+BIND_PARAMETER = re.compile(r"(?<![:\w]):(\w+)")
+
+
+def isPythonMigration(migrationName):
+    return migrationName.lower().endswith(".py")
+
+
+def loadMigration(migrationName, source, path):
+    """Runs a migration's source in a new module and returns the module.
+    """
+    module = types.ModuleType(str("goose_migration_%s"%(
+                re.sub(r"[^A-Za-z0-9_]", "_", migrationName),)))
+    module.__file__ = path
+    exec compile(source, path, "exec") in module.__dict__
+    if not callable(getattr(module, "forward", None)):
+        raise ValueError("%s doesn't define forward(migration)"%(migrationName,))
+    return module
+
+
+def parameterNames(sql):
+    names = []
+    for name in BIND_PARAMETER.findall(sql):
+        if name not in names:
+            names.append(name)
+    return names
+
+
+class MigrationContext(object):
+    """What a Python migration's forward function is given.
+
+    ``connection`` is the SQLAlchemy connection goose is migrating with
+    and ``dialect`` the name of its database, e.g. "postgresql".
+    ``statements`` counts the statements run, which is what ends up in
+    migration_info.
+    """
+
+    def __init__(self, session, before=None, after=None):
+        self.connection = session.connection()
+        self.dialect = self.connection.dialect.name
+        self.before = before
+        self.after = after
+        self.statements = 0
+
+    def _run(self, connection, sql, params):
+        statement = tokenizer.Statement(sql, None)
+        if self.before is not None:
+            self.before(statement)
+        start = time.time()
+        result = connection.execute(sqlalchemy.text(sql), params)
+        self.statements += 1
+        if self.after is not None:
+            self.after(statement, time.time() - start,
+                       getattr(result, "rowcount", None))
+        return result
+
+    def execute(self, sql, params=None):
+        """Runs one statement and returns its result.
+        """
+        return self._run(self.connection, sql, params or {})
+
+    def iterChunks(self, query, params=None, size=CHUNK_SIZE):
+        """Yields the rows of ``query`` in lists of up to ``size``.
+        """
+        connection = self.connection.execution_options(stream_results=True)
+        result = self._run(connection, query, params or {})
+        try:
+            while True:
+                rows = result.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            result.close()
+
+    def writeMany(self, sql, rows):
+        """Runs ``sql`` once for each row with a single executemany.
+
+        Returns the number of rows written.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        if not isinstance(rows[0], dict):
+            names = parameterNames(sql)
+            rows = [dict(zip(names, row)) for row in rows]
+        self._run(self.connection, sql, rows)
+        return len(rows)
@@ -0,0 +1,205 @@
+"""render.py
+
+Renders pending migrations as one SQL script for a native client.
+
+``psql``, ``sqlite3`` and ``mysql`` run a large script far faster than
+goose can send it a statement at a time, so instead of applying the
+migrations ``migrate --render`` writes them, along with the
+migration_info rows that record them, to stdout::
+
+  goose -d postgresql://db/app -m migrations/ migrate --render | psql app
+
+Each migration is wrapped in its own transaction and the script stops
+at the first error, so a failed migration is never recorded.  With
+``--via-client`` goose starts the client itself, streams the script
+into it and then checks that every rendered migration was recorded::
+
+  goose -d sqlite:///app.db -m migrations/ migrate --render --via-client
+
+The database is still queried (with SQLAlchemy) to decide what is
+pending and to verify the result; only the migrations themselves go
+through the client.
+
+"""
+import os
+import subprocess
+
+from goose import batching
+from goose import pymigration
+
+
+DIALECTS = ("postgresql", "sqlite", "mysql")
+
+
+def dialectName(dsn):
+    """postgresql+psycopg2://... -> postgresql"""
+    scheme = dsn.split(":", 1)[0]
+    name = scheme.split("+", 1)[0]
+    if name == "postgres":
+        name = "postgresql"
+    return name
+
+
+def literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, long, float)):
+        return repr(value)
+    return "'%s'"%(str(value).replace("'", "''"),)
+
+
+def recordMigrationSql(version, name, checksum=None, statementCount=None,
+                       schemaVersion=2):
+    """The INSERT that models.recordMigration would have made.
+    """
+    values = [("version", version), ("name", name)]
+    if schemaVersion >= 2:
+        values.extend([("checksum", checksum),
+                       ("statement_count", statementCount)])
+    return "INSERT INTO migration_info (%s, migration_date) VALUES (%s, CURRENT_TIMESTAMP)"%(
+        ", ".join(column for column, value in values),
+        ", ".join(literal(value) for column, value in values))
+
+
+class ScriptWriter(object):
+    """Writes statements to ``out`` the way ``dialect``'s client wants them."""
+    def __init__(self, out, dialect):
+        if dialect not in DIALECTS:
+            raise ValueError("Can't render SQL for %s, only for %s"%(
+                    dialect, ", ".join(DIALECTS)))
+        self.out = out
+        self.dialect = dialect
+
+    def comment(self, text):
+        self.out.write("-- %s\n"%(text,))
+
+    def prologue(self):
+        if self.dialect == "sqlite":
+            self.out.write(".bail on\n")
+        elif self.dialect == "postgresql":
+            self.out.write("\\set ON_ERROR_STOP on\n")
+
+    def statement(self, statement):
+        statement = statement.strip()
+        if self.dialect == "mysql" and ";" in statement:
+            # compound statements from DELIMITER blocks
+            self.out.write("DELIMITER $$\n%s$$\nDELIMITER ;\n"%(statement,))
+        else:
+            self.out.write("%s;\n"%(statement,))
+
+    def begin(self):
+        self.out.write("START TRANSACTION;\n" if self.dialect == "mysql"
+                       else "BEGIN;\n")
+
+    def commit(self):
+        self.out.write("COMMIT;\n")
+
+
+def renderMigrations(migrator, migrations, out, dialect, schemaVersion=2):
+    """Writes a script applying ``migrations``, (version, name) pairs.
+
+    Returns the number of statements written, not counting bookkeeping.
+    """
+    writer = ScriptWriter(out, dialect)
+    python = [name for version, name in migrations
+              if pymigration.isPythonMigration(name)]
+    if python:
+        raise ValueError("Python migrations can't be rendered as SQL: %s"%(
+                ", ".join(python),))
+    # checked before anything is written, a client may already be
+    # running whatever comes out
+    chunked = [name for version, name in migrations
+               if any(statement.directives
+                      for statement in migrator.statements(name))]
+    if chunked:
+        raise ValueError("Migrations with goose: directives can't be rendered"
+                         " as SQL: %s"%(", ".join(chunked),))
+    writer.prologue()
+    total = 0
+    for version, name in migrations:
+        checksum = None
+        if schemaVersion >= 2:
+            checksum = migrator.checksum(name)
+        writer.comment("goose: %s to version %s"%(name, version))
+        writer.begin()
+        statements = migrator.statements(name)
+        if migrator.batchSize:
+            statements = batching.batchInserts(statements, migrator.batchSize)
+        count = 0
+        for statement in statements:
+            writer.statement(statement)
+            count += 1
+        for record in migrator.recordsFor({"version": version, "name": name,
+                                           "checksum": checksum,
+                                           "statementCount": count,
+                                           "duration": None}):
+            writer.statement(recordMigrationSql(
+                    record["version"], record["name"], record["checksum"],
+                    record["statementCount"], schemaVersion))
+        writer.commit()
+        total += count
+    return total
+
+
+def connectionArguments(url, dialect):
+    """
+    The host, port and user flags for the command line tools of
+    ``dialect`` and an environment holding the password.
+    """
+    environment = dict(os.environ)
+    if dialect == "postgresql":
+        flags = (("-h", url.host), ("-p", url.port), ("-U", url.username))
+        variable = "PGPASSWORD"
+    elif dialect == "mysql":
+        flags = (("-h", url.host), ("-P", url.port), ("-u", url.username))
+        variable = "MYSQL_PWD"
+    else:
+        raise ValueError("No command line tools known for %s"%(dialect,))
+    arguments = []
+    for flag, value in flags:
+        if value:
+            arguments.extend([flag, str(value)])
+    if url.password:
+        environment[variable] = url.password
+    return arguments, environment
+
+
+def clientCommand(dsn):
+    """The command line and environment for the native client of ``dsn``.
+    """
+    from sqlalchemy.engine.url import make_url
+    url = make_url(dsn)
+    dialect = dialectName(dsn)
+    if dialect == "sqlite":
+        if not url.database or url.database == ":memory:":
+            raise ValueError("--via-client needs a sqlite database file")
+        return ["sqlite3", url.database], dict(os.environ)
+    if dialect == "postgresql":
+        arguments, environment = connectionArguments(url, dialect)
+        return (["psql", "--no-psqlrc", "--quiet"] + arguments +
+                ["-d", url.database]), environment
+    if dialect == "mysql":
+        arguments, environment = connectionArguments(url, dialect)
+        return ["mysql", "--batch"] + arguments + [url.database], environment
+    raise ValueError("No native client known for %s"%(dialect,))
+
+
+def runClient(dsn, write):
+    """Starts the client for ``dsn`` and calls write(stdin) to feed it.
+    """
+    command, environment = clientCommand(dsn)
+    try:
+        client = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                  env=environment)
+    except OSError, e:
+        raise ValueError("Unable to run %s: %s"%(command[0], e))
+    try:
+        result = write(client.stdin)
+        client.stdin.close()
+    except IOError:
+        # the client quit early, its exit status says why
+        result = None
+    returncode = client.wait()
+    if returncode != 0:
+        raise ValueError("%s exited with status %s"%(command[0], returncode))
+    return result
@@ -0,0 +1,124 @@
+"""scheduler.py
+
+Applies independent migrations at the same time.
+
+Index entries can say which migrations they depend on (see
+`goose.indexfile.migrationEntries`)::
+
+  migrations:
+    - create_users.sql
+    - create_orders.sql
+    - name: index_users.sql
+      depends: [create_users.sql]
+    - name: backfill_orders.sql
+      depends: [create_orders.sql]
+
+With ``goose migrate --jobs 2`` index_users.sql and backfill_orders.sql
+run side by side, each on its own connection, as soon as the migration
+they depend on has been applied.  Every migration is still applied and
+recorded in migration_info in a transaction of its own, so a database
+is never left with a migration applied but not recorded.  After a
+failure no more migrations are started; the ones already running are
+allowed to finish and the first error is raised.
+
+SQLite only allows one writer at a time, so migrations to a SQLite
+database are always applied one at a time.
+
+"""
+import Queue
+import copy
+import heapq
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+class Scheduler(object):
+    def __init__(self, migrator, workers=4):
+        self.migrator = migrator
+        self.workers = workers
+        self.local = threading.local()
+        self.targets = []
+        self.lock = threading.Lock()
+
+    def targetMigrator(self):
+        """The migrator, with its own connection, for the current thread."""
+        target = getattr(self.local, "migrator", None)
+        if target is None:
+            target = copy.copy(self.migrator)
+            target.verbose = False
+            target.connect(self.migrator.dsn)
+            self.local.migrator = target
+            with self.lock:
+                self.targets.append(target)
+        return target
+
+    def apply(self, version, migrationName, done):
+        start = time.time()
+        try:
+            target = self.targetMigrator()
+            target.runMigration(migrationName, version)
+        except:
+            done.put((version, migrationName, time.time() - start,
+                      sys.exc_info()))
+        else:
+            done.put((version, migrationName, time.time() - start, None))
+
+    def run(self, migrations):
+        """
+        Applies ``migrations``, (version, name) pairs, each as soon as
+        the ones it depends on have been, and returns the names of the
+        ones applied in the order they finished.
+        """
+        pending = dict((name, version) for version, name in migrations)
+        waitingOn = {}
+        dependents = dict((name, []) for name in pending)
+        for version, name in migrations:
+            depends = [dependency for dependency
+                       in self.migrator.dependencies.get(name, ())
+                       if dependency in pending]
+            waitingOn[name] = len(depends)
+            for dependency in depends:
+                dependents[dependency].append(name)
+        ready = [(version, name) for version, name in migrations
+                 if not waitingOn[name]]
+        heapq.heapify(ready)
+        done = Queue.Queue()
+        running = 0
+        applied = []
+        error = None
+        pool = ThreadPool(max(1, min(self.workers, len(migrations))))
+        try:
+            while True:
+                while ready and error is None:
+                    version, name = heapq.heappop(ready)
+                    pool.apply_async(self.apply, (version, name, done))
+                    running += 1
+                if not running:
+                    break
+                version, name, elapsed, failure = done.get()
+                running -= 1
+                if failure is not None:
+                    if error is None:
+                        error = failure
+                    if self.migrator.verbose:
+                        print "Running migration %s to version %s: FAILED (%.1fs)"%(
+                            name, version, elapsed)
+                    continue
+                applied.append(name)
+                if self.migrator.verbose:
+                    print "Running migration %s to version %s: SUCCESS! (%.1fs)"%(
+                        name, version, elapsed)
+                for dependent in dependents[name]:
+                    waitingOn[dependent] -= 1
+                    if not waitingOn[dependent]:
+                        heapq.heappush(ready, (pending[dependent], dependent))
+        finally:
+            pool.close()
+            pool.join()
+            for target in self.targets:
+                target.close()
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return applied
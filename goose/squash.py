@@ -0,0 +1,194 @@
+"""squash.py
+
+Replaces the first N migrations of an index with a single baseline.
+
+``goose squash`` applies versions 1 to N to a scratch database, dumps
+the schema and data they left behind (less goose's own tables) into a
+baseline migration and adds it to the index::
+
+  goose -m migrations/ squash -t 400 --scratch postgresql://localhost/scratch
+
+  baseline:
+    name: baseline_0400.sql
+    version: 400
+  migrations:
+    - ...
+
+The migrations it replaces stay in the index.  ``migrate`` runs the
+baseline instead of them on a database that hasn't had any migration
+applied yet, records versions 1 to N as applied and carries on with the
+entries after them.  Databases that have applied any migrations are
+migrated exactly as before, which is why the files of the replaced
+migrations may only be deleted once no database still needs them.
+
+The dump is in the scratch database's dialect, so it should be the
+same kind of database as the ones being migrated, and empty.  By
+default it's a temporary SQLite file.
+
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from goose import core
+from goose import models
+from goose import render
+
+
+BOOKKEEPING_TABLES = (models.migration_table.name, models.schema_table.name,
+                      models.progress_table.name)
+
+# pg_dump (10.3 and later) empties search_path for the rest of the
+# session.  The baseline runs on goose's own connection, which still
+# has to find migration_info afterwards, and the dump qualifies every
+# name anyway, so it's left out.
+SEARCH_PATH = re.compile(r"^\s*SELECT pg_catalog\.set_config\('search_path', '', false\);\s*$")
+
+
+def dumpSqlite(database, out):
+    """
+    Writes the schema and data of a SQLite database to ``out``, without
+    goose's tables.  Returns the number of statements written.
+    """
+    import sqlite3
+    connection = sqlite3.connect(database)
+    try:
+        skip = set(sql.strip() for sql, in connection.execute(
+                "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND"
+                " tbl_name IN (%s)"%(", ".join("?" for t in BOOKKEEPING_TABLES),),
+                BOOKKEEPING_TABLES))
+        inserts = tuple('INSERT INTO "%s"'%(table,) for table in BOOKKEEPING_TABLES)
+        count = 0
+        for statement in connection.iterdump():
+            if (statement in ("BEGIN TRANSACTION;", "COMMIT;") or
+                statement.rstrip(";") in skip or statement.startswith(inserts) or
+                (statement.startswith('INSERT INTO "sqlite_sequence"') and
+                 any("'%s'"%(table,) in statement for table in BOOKKEEPING_TABLES))):
+                continue
+            if statement.upper().startswith("CREATE TRIGGER"):
+                # the body has semicolons of its own
+                statement = "DELIMITER $$\n%s$$\nDELIMITER ;"%(statement.rstrip(";"),)
+            out.write(statement.encode("utf-8"))
+            out.write("\n")
+            count += 1
+        return count
+    finally:
+        connection.close()
+
+
+def dumpCommand(dsn):
+    """The command line and environment dumping a server database."""
+    from sqlalchemy.engine.url import make_url
+    url = make_url(dsn)
+    dialect = render.dialectName(dsn)
+    arguments, environment = render.connectionArguments(url, dialect)
+    if dialect == "postgresql":
+        # INSERTs rather than COPY, which goose can't run
+        command = ["pg_dump", "--no-owner", "--no-privileges", "--column-inserts"]
+        command.extend("--exclude-table=%s"%(table,) for table in BOOKKEEPING_TABLES)
+    else:
+        command = ["mysqldump", "--skip-comments", "--routines", "--skip-add-locks"]
+        command.extend("--ignore-table=%s.%s"%(url.database, table)
+                       for table in BOOKKEEPING_TABLES)
+    return command + arguments + [url.database], environment
+
+
+def dump(dsn, out):
+    if render.dialectName(dsn) == "sqlite":
+        from sqlalchemy.engine.url import make_url
+        dumpSqlite(make_url(dsn).database, out)
+        return
+    command, environment = dumpCommand(dsn)
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   env=environment)
+    except OSError, e:
+        raise ValueError("Unable to run %s: %s"%(command[0], e))
+    for line in process.stdout:
+        if not SEARCH_PATH.match(line):
+            out.write(line)
+    if process.wait() != 0:
+        raise ValueError("%s exited with status %s"%(command[0], process.returncode))
+
+
+def baselineName(version):
+    return "baseline_%04d.sql"%(version,)
+
+
+def addBaseline(indexFilepath, index, name, version):
+    """Records the baseline in the index file."""
+    if indexFilepath.lower().endswith(".json"):
+        index = dict(index, baseline={"name": name, "version": version})
+        with open(indexFilepath, "w") as f:
+            json.dump(index, f, indent=2)
+        return
+    if "baseline" in index:
+        import yaml
+        index = dict(index, baseline={"name": name, "version": version})
+        with open(indexFilepath, "w") as f:
+            yaml.safe_dump(index, f, default_flow_style=False)
+        return
+    # insert rather than rewrite so the rest of the file is untouched,
+    # before the first key so that entries can still be appended to the
+    # migrations at the end of the file
+    with open(indexFilepath, "r") as f:
+        text = f.read()
+    match = re.search(r"^[A-Za-z_]\w*\s*:", text, re.M)
+    position = match.start() if match else len(text)
+    with open(indexFilepath, "w") as f:
+        f.write(text[:position])
+        f.write("baseline:\n  name: %s\n  version: %s\n"%(name, version))
+        f.write(text[position:])
+
+
+def squash(migrationDirectory, toVersion=None, scratchDsn=None, name=None):
+    """
+    Writes a baseline for versions 1 to ``toVersion`` (all of them by
+    default) and adds it to the index.  Returns the baseline's name and
+    version.
+    """
+    if os.path.isfile(migrationDirectory):
+        raise ValueError("Only a migration directory can be squashed, not a bundle")
+    migrator = core.getMigrator(migrationDirectory)
+    version = toVersion or len(migrator.migrations)
+    if not 0 < version <= len(migrator.migrations):
+        raise ValueError("There's no version %s in the index"%(version,))
+    name = name or baselineName(version)
+    path = os.path.join(migrator.migrationDirectory, name)
+    if os.path.exists(path):
+        raise ValueError("%s already exists"%(path,))
+    scratchDirectory = None
+    if scratchDsn is None:
+        scratchDirectory = tempfile.mkdtemp(prefix="goose-squash-")
+        scratchDsn = "sqlite:///%s"%(os.path.join(scratchDirectory, "scratch.db"),)
+    try:
+        migrator.verbose = False
+        migrator.connect(scratchDsn)
+        models.init(migrator.engine)
+        if migrator.plan().applied:
+            raise ValueError("The scratch database has to be empty")
+        migrator.migrate(toVersion=version)
+        migrator.close()
+        models.engines.dispose(scratchDsn)
+        partialPath = path + ".partial"
+        try:
+            with open(partialPath, "w") as out:
+                out.write("-- goose baseline for versions 1 to %s (%s to %s),"
+                          " made by goose squash on %s\n"%(
+                        version, migrator.migrations[0],
+                        migrator.migrations[version - 1],
+                        time.strftime("%Y-%m-%d %H:%M:%S")))
+                dump(scratchDsn, out)
+        except:
+            os.remove(partialPath)
+            raise
+        os.rename(partialPath, path)
+    finally:
+        if scratchDirectory is not None:
+            shutil.rmtree(scratchDirectory)
+    addBaseline(migrator.indexFilepath, migrator.index, name, version)
+    return name, version
@@ -1 +1,22 @@
 # __init__.py
+import os
+import shutil
+import tempfile
+
+
+def temporaryCache():
+    """
+    Points goose's index cache, see goose.indexfile, at a new temporary
+    directory so tests don't fill the real one.  Returns a function
+    that puts it back, for setUpModule and tearDownModule.
+    """
+    directory = tempfile.mkdtemp(prefix="goose-cache-")
+    old = os.environ.get("GOOSE_CACHE_DIR")
+    os.environ["GOOSE_CACHE_DIR"] = directory
+    def restore():
+        if old is None:
+            os.environ.pop("GOOSE_CACHE_DIR", None)
+        else:
+            os.environ["GOOSE_CACHE_DIR"] = old
+        shutil.rmtree(directory, ignore_errors=True)
+    return restore
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from goose import core
+from goose import test
+from goose.bench import corpus
+from goose.bench import suite
+
+
+def setUpModule():
+    global restoreCache
+    restoreCache = test.temporaryCache()
+
+
+def tearDownModule():
+    restoreCache()
+
+
+class TestCorpora(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_statementCounts(self):
+        for name in sorted(corpus.CORPORA):
+            directory = os.path.join(self.directory, name)
+            os.mkdir(directory)
+            statements = corpus.build(name, directory, scale=0.01)
+            migrator = core.getMigrator(directory)
+            self.assertEqual(sum(len(list(migrator.statements(migration)))
+                                 for migration in migrator.migrations),
+                             statements, name)
+
+
+class TestSuite(unittest.TestCase):
+    def test_report(self):
+        report = suite.runSuite(scale=0.01, repeat=1, only=["giant-load"],
+                                log=None)
+        self.assertEqual([(result["benchmark"], result["corpus"])
+                          for result in report["results"]],
+                         [("parse", "giant-load"),
+                          ("execute", "giant-load"),
+                          ("execute-batched", "giant-load")])
+        for result in report["results"]:
+            self.assertEqual(result["statements"], 2001)
+            self.assertTrue(result["peakRssKb"] > 0)
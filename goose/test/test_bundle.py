@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from goose import bundle
+from goose import core
+from goose import test
+
+
+def setUpModule():
+    global restoreCache
+    restoreCache = test.temporaryCache()
+
+
+def tearDownModule():
+    restoreCache()
+
+
+class TestBundle(unittest.TestCase):
+    def setUp(self):
+        self.migrationDirectory = os.path.join(core.ROOT, "testmigrations")
+        self.tempDirectory = tempfile.mkdtemp()
+        self.bundlePath = os.path.join(self.tempDirectory, "test.goose")
+        self.migrator = core.getMigrator(self.migrationDirectory)
+        bundle.compileBundle(self.migrator, self.bundlePath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDirectory)
+
+    def test_getMigratorLoadsBundles(self):
+        migrator = core.getMigrator(self.bundlePath)
+        self.assertTrue(isinstance(migrator, bundle.BundleMigrator))
+        self.assertEqual(migrator.migrations, self.migrator.migrations)
+
+    def test_statements(self):
+        migrator = bundle.BundleMigrator(self.bundlePath)
+        for migration in self.migrator.migrations:
+            fromBundle = list(migrator.statements(migration))
+            fromFile = list(self.migrator.statements(migration))
+            self.assertEqual(fromBundle, fromFile)
+            self.assertEqual([s.offset for s in fromBundle],
+                             [s.offset for s in fromFile])
+
+    def test_manifest(self):
+        migrator = bundle.BundleMigrator(self.bundlePath)
+        entry = migrator.entries["track.sql"]
+        self.assertEqual(entry["statements"], 2)
+        self.assertEqual(len(entry["sha1"]), 40)
+
+    def test_notABundle(self):
+        self.assertRaises(ValueError, bundle.BundleMigrator,
+                          os.path.join(self.migrationDirectory, "create.sql"))
+
+    def test_compileSubcommand(self):
+        output = os.path.join(self.tempDirectory, "cli.goose")
+        core.main(["-m", self.migrationDirectory, "compile", "-o", output])
+        self.assertEqual(core.getMigrator(output).migrations,
+                         self.migrator.migrations)
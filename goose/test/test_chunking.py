@@ -0,0 +1,63 @@
+import unittest
+
+from goose import chunking
+
+
+class TestChunkTemplate(unittest.TestCase):
+    def test_addsWhere(self):
+        restrict = chunking.chunkTemplate("UPDATE t SET x = 1", "id")
+        self.assertEqual(restrict(1, 11),
+                         "UPDATE t SET x = 1 WHERE id >= 1 AND id < 11")
+
+    def test_keepsCondition(self):
+        restrict = chunking.chunkTemplate(
+            "DELETE FROM t WHERE x IS NULL OR y = 'where'\n", "id")
+        self.assertEqual(restrict(0, 5),
+                         "DELETE FROM t WHERE (id >= 0 AND id < 5)"
+                         " AND (x IS NULL OR y = 'where')")
+
+    def test_subqueryWhereIsNotTopLevel(self):
+        restrict = chunking.chunkTemplate(
+            "UPDATE t SET x = (SELECT max(y) FROM u WHERE u.t = t.id)", "id")
+        self.assertEqual(restrict(0, 5),
+                         "UPDATE t SET x = (SELECT max(y) FROM u WHERE u.t = t.id)"
+                         " WHERE id >= 0 AND id < 5")
+
+    def test_commentsAreSkipped(self):
+        restrict = chunking.chunkTemplate(
+            "UPDATE t SET x = 1 /* fix where\nmissing */", "id")
+        self.assertEqual(restrict(1, 11),
+                         "UPDATE t SET x = 1 /* fix where\nmissing */"
+                         " WHERE id >= 1 AND id < 11")
+
+    def test_rejectsOtherTables(self):
+        for statement in ("UPDATE t SET x = u.x FROM u WHERE u.id = t.id",
+                          "DELETE FROM t USING u WHERE u.id = t.id",
+                          "UPDATE t JOIN u ON u.id = t.id SET t.x = u.x",
+                          "UPDATE t, u SET t.x = u.x WHERE u.id = t.id"):
+            self.assertRaises(ValueError, chunking.chunkTemplate, statement, "id")
+
+    def test_rejectsLimit(self):
+        self.assertRaises(ValueError, chunking.chunkTemplate,
+                          "DELETE FROM t WHERE x = 1 LIMIT 10", "id")
+
+
+class TestChunkOptions(unittest.TestCase):
+    def test_defaults(self):
+        self.assertEqual(chunking.chunkOptions({"key": "id"}),
+                         {"key": "id", "size": chunking.DEFAULT_SIZE,
+                          "sleep": 0.0, "table": None})
+
+    def test_invalid(self):
+        for options in ({}, {"key": "id", "size": "big"},
+                        {"key": "id", "size": "0"}):
+            self.assertRaises(ValueError, chunking.chunkOptions, options)
+
+    def test_tableName(self):
+        options = chunking.chunkOptions({"key": "id"})
+        self.assertEqual(chunking.tableName("  update orders set x = 1", options),
+                         "orders")
+        self.assertEqual(chunking.tableName("DELETE FROM app.orders", options),
+                         "app.orders")
+        self.assertRaises(ValueError, chunking.tableName,
+                          "INSERT INTO orders VALUES (1)", options)
@@ -1,10 +1,31 @@
 # __init__.py
 
+import StringIO
 import json
 import os
+import subprocess
+import sys
 import unittest
 
+from goose import backup
 from goose import core
+from goose import events
+from goose import instrumentation
+from goose import models
+from goose import planner
+from goose import profiling
+from goose import render
+from goose import test
+from goose import tokenizer
+
+
+def setUpModule():
+    global restoreCache
+    restoreCache = test.temporaryCache()
+
+
+def tearDownModule():
+    restoreCache()
 
 
 class FakeResult(object):
@@ -175,6 +196,9 @@ DELIMITER ;
     def test_postgresqlStoredProc(self):
         """And of course PGSQL syntax just works...  I miss you PostgreSQL.
 
+        Semicolons inside a dollar quoted function body don't end
+        the statement.
+
         """
         cursor = RecordingCursor()
         sql = """
@@ -189,11 +213,7 @@ END;
 $$ LANGUAGE plpgsql;
         """
         core.executeBatch(cursor, sql)
-        self.assertEquals(cursor.statements, ['CREATE FUNCTION add_three_values(v1 anyelement, v2 anyelement, v3 anyelement)\nRETURNS anyelement AS $$\nDECLARE\n    result ALIAS FOR $0',
- '\nBEGIN\n    result := v1 + v2 + v3',
- '\n    RETURN result',
- '\nEND',
- '\n$$ LANGUAGE plpgsql'])
+        self.assertEquals(cursor.statements, ['CREATE FUNCTION add_three_values(v1 anyelement, v2 anyelement, v3 anyelement)\nRETURNS anyelement AS $$\nDECLARE\n    result ALIAS FOR $0;\nBEGIN\n    result := v1 + v2 + v3;\n    RETURN result;\nEND;\n$$ LANGUAGE plpgsql'])
 
 
     def test_twoStatements(self):
@@ -227,3 +247,297 @@ select 3
 
 
 
+class TestExecuteBatchInserts(unittest.TestCase):
+    def test_consecutiveInsertsAreCombined(self):
+        cursor = RecordingCursor()
+        sql = """INSERT INTO t (a, b) VALUES (1, 'x;y');
+insert into T (a,  b) values (2, 'it''s');
+INSERT INTO t (a, b) VALUES (3, lower('Z'));
+"""
+        core.executeBatch(cursor, sql, batchSize=100)
+        self.assertEquals(cursor.statements, [
+                "INSERT INTO t (a, b) VALUES (1, 'x;y'),\n(2, 'it''s'),\n(3, lower('Z'))"])
+
+    def test_batchSize(self):
+        cursor = RecordingCursor()
+        sql = "".join("INSERT INTO t VALUES (%d);\n" % (i,) for i in range(5))
+        core.executeBatch(cursor, sql, batchSize=2)
+        self.assertEquals(cursor.statements, [
+                "INSERT INTO t VALUES (0),\n(1)",
+                "INSERT INTO t VALUES (2),\n(3)",
+                "\nINSERT INTO t VALUES (4)"])
+
+    def test_otherStatementsEndABatch(self):
+        cursor = RecordingCursor()
+        sql = """INSERT INTO t VALUES (1);
+INSERT INTO u VALUES (2);
+INSERT INTO u (a) VALUES (3);
+UPDATE u SET a = 4;
+INSERT INTO u (a) VALUES (5);
+"""
+        core.executeBatch(cursor, sql, batchSize=100)
+        self.assertEquals(cursor.statements, ["INSERT INTO t VALUES (1)",
+                                              "\nINSERT INTO u VALUES (2)",
+                                              "\nINSERT INTO u (a) VALUES (3)",
+                                              "\nUPDATE u SET a = 4",
+                                              "\nINSERT INTO u (a) VALUES (5)"])
+
+    def test_quotedNamesAreCaseSensitive(self):
+        cursor = RecordingCursor()
+        sql = """INSERT INTO "Foo" VALUES (1);
+INSERT INTO "foo" VALUES (2);
+INSERT INTO "foo" ("A") VALUES (3);
+INSERT INTO "foo" ("a") VALUES (4);
+INSERT INTO public."Foo" VALUES (5);
+INSERT INTO PUBLIC."Foo" VALUES (6);
+"""
+        core.executeBatch(cursor, sql, batchSize=100)
+        self.assertEquals(cursor.statements, [
+                'INSERT INTO "Foo" VALUES (1)',
+                '\nINSERT INTO "foo" VALUES (2)',
+                '\nINSERT INTO "foo" ("A") VALUES (3)',
+                '\nINSERT INTO "foo" ("a") VALUES (4)',
+                'INSERT INTO public."Foo" VALUES (5),\n(6)'])
+
+    def test_unbatchableInserts(self):
+        cursor = RecordingCursor()
+        sql = """INSERT INTO t VALUES (1) ON CONFLICT DO NOTHING;
+INSERT INTO t VALUES (2) ON CONFLICT DO NOTHING;
+INSERT INTO t SELECT * FROM u;
+INSERT INTO t VALUES ('C:\\');
+INSERT INTO t VALUES ('x');
+"""
+        core.executeBatch(cursor, sql, batchSize=100)
+        self.assertEquals(len(cursor.statements), 5)
+
+
+class TestMigrationPlan(unittest.TestCase):
+    migrations = ["create.sql", "track.sql", "bad.sql", "good.sql"]
+
+    def test_emptyDatabase(self):
+        plan = planner.MigrationPlan(self.migrations, [])
+        self.assertEqual(plan.pending, list(enumerate(self.migrations, 1)))
+        self.assertEqual(plan.highest, None)
+        self.assertEqual(plan.gaps, [])
+        self.assertTrue(plan.isConsistent())
+
+    def test_gaps(self):
+        plan = planner.MigrationPlan(self.migrations,
+                                     [(1, "create.sql"), (3, "bad.sql")])
+        self.assertEqual(plan.pending, [(2, "track.sql"), (4, "good.sql")])
+        self.assertEqual(plan.gaps, [(2, "track.sql")])
+        self.assertEqual(plan.pendingUpTo(3), [(2, "track.sql")])
+        self.assertTrue(plan.isConsistent())
+        self.assertEqual(len(plan.report()), 1)
+
+    def test_mismatchedAndUnknown(self):
+        plan = planner.MigrationPlan(self.migrations,
+                                     [(1, "create.sql"), (2, "bad.sql"),
+                                      (7, "later.sql")])
+        self.assertEqual(plan.mismatched, [(2, "track.sql", "bad.sql")])
+        self.assertEqual(plan.unknown, [(7, "later.sql")])
+        self.assertFalse(plan.isConsistent())
+        self.assertEqual(len(plan.report()), 4)
+
+
+class TestModels(unittest.TestCase):
+    def test_initWithoutBind(self):
+        bind = models.metadata.bind
+        models.metadata.bind = None
+        try:
+            self.assertRaises(ValueError, models.init)
+        finally:
+            models.metadata.bind = bind
+
+    def test_isInMemory(self):
+        self.assertTrue(models.isInMemory("sqlite:///:memory:"))
+        self.assertTrue(models.isInMemory("sqlite://"))
+        self.assertFalse(models.isInMemory("sqlite:///app.db"))
+        self.assertFalse(models.isInMemory("postgresql://db/app"))
+
+
+class TestStartup(unittest.TestCase):
+    # importing goose.core shouldn't take anywhere near this long, while
+    # importing SQLAlchemy alone usually does
+    IMPORT_BUDGET = 0.1
+
+    def importCore(self, code=""):
+        root = os.path.dirname(core.ROOT)
+        return subprocess.check_output(
+            [sys.executable, "-c",
+             "import sys, time\n"
+             "start = time.time()\n"
+             "import goose.core\n"
+             "elapsed = time.time() - start\n" + code],
+            cwd=root, stderr=open(os.devnull, "w")).split()
+
+    def test_importDoesNotLoadDatabaseModules(self):
+        loaded = self.importCore(
+            "for name in ('sqlalchemy', 'goose.models', 'yaml', 'argparse'):\n"
+            "    print name in sys.modules\n")
+        self.assertEqual(loaded, ["False"] * 4)
+
+    def test_importTime(self):
+        elapsed = min(float(self.importCore("print elapsed")[0])
+                      for attempt in range(3))
+        self.assertTrue(elapsed < self.IMPORT_BUDGET,
+                        "importing goose.core took %.3fs"%(elapsed,))
+
+    def test_version(self):
+        self.assertEqual(self.importCore(
+                "try:\n"
+                "    goose.core.main(['--version'])\n"
+                "except SystemExit:\n"
+                "    pass\n"
+                "print 'sqlalchemy' in sys.modules\n"), ["False"])
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_statementHooks(self):
+        calls = []
+        cursor = RecordingCursor()
+        count = core.executeStatements(
+            cursor, tokenizer.iterStatements("select 1;\nselect 2;"),
+            before=lambda statement: calls.append(("before", statement)),
+            after=lambda statement, elapsed, rowcount: calls.append(
+                ("after", statement.offset, rowcount)))
+        self.assertEqual(count, 2)
+        self.assertEqual(calls, [("before", "select 1"),
+                                 ("after", 0, None),
+                                 ("before", "\nselect 2"),
+                                 ("after", 10, None)])
+
+    def test_slowStatementReport(self):
+        report = instrumentation.SlowStatementReport(2)
+        for elapsed, offset in [(0.5, 0), (2.0, 10), (0.1, 20), (1.0, 30)]:
+            report.afterStatement("m.sql", 1,
+                                  tokenizer.Statement("select %s"%(offset,), offset),
+                                  elapsed, 1)
+        self.assertEqual([(elapsed, offset) for elapsed, name, offset, rows, s
+                          in report.entries()], [(2.0, 10), (1.0, 30)])
+        lines = report.report()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue("m.sql@10" in lines[1])
+
+
+class TestRender(unittest.TestCase):
+    def render(self, sql, dialect):
+        out = StringIO.StringIO()
+        writer = render.ScriptWriter(out, dialect)
+        for statement in tokenizer.iterStatements(sql):
+            writer.statement(statement)
+        return out.getvalue()
+
+    def test_dialectName(self):
+        self.assertEqual(render.dialectName("postgresql+psycopg2://u:p@h/db"),
+                         "postgresql")
+        self.assertEqual(render.dialectName("sqlite:///x.db"), "sqlite")
+
+    def test_mysqlCompoundStatements(self):
+        sql = """DELIMITER $$
+CREATE PROCEDURE p() BEGIN SELECT 1; SELECT 2; END$$
+DELIMITER ;
+SELECT 3;
+"""
+        self.assertEqual(self.render(sql, "mysql"),
+                         "DELIMITER $$\n"
+                         "CREATE PROCEDURE p() BEGIN SELECT 1; SELECT 2; END$$\n"
+                         "DELIMITER ;\n"
+                         "SELECT 3;\n")
+
+    def test_recordMigrationSql(self):
+        self.assertEqual(render.recordMigrationSql(3, "it's.sql", "abc", 7),
+                         "INSERT INTO migration_info (version, name, checksum,"
+                         " statement_count, migration_date) VALUES (3,"
+                         " 'it''s.sql', 'abc', 7, CURRENT_TIMESTAMP)")
+        self.assertEqual(render.recordMigrationSql(3, "a.sql", schemaVersion=1),
+                         "INSERT INTO migration_info (version, name,"
+                         " migration_date) VALUES (3, 'a.sql', CURRENT_TIMESTAMP)")
+
+    def test_unknownDialect(self):
+        self.assertRaises(ValueError, render.ScriptWriter, None, "oracle")
+
+
+class TestBackup(unittest.TestCase):
+    def test_postgresql(self):
+        command, environment = backup.dumpCommand(
+            "postgresql://mike:secret@db:5433/app", "app.dump", 3)
+        self.assertEqual(command, ["pg_dump", "--format=directory", "--jobs=3",
+                                   "--compress=6", "--file=app.dump",
+                                   "-h", "db", "-p", "5433", "-U", "mike", "app"])
+        self.assertEqual(environment["PGPASSWORD"], "secret")
+        [(command, environment, inputPath)] = backup.restoreCommands(
+            "postgresql://db/app", "app.dump", 2)
+        self.assertEqual(command, ["pg_restore", "--clean", "--if-exists",
+                                   "--create", "--jobs=2", "-h", "db",
+                                   "--dbname=postgres", "app.dump"])
+        self.assertEqual(inputPath, None)
+
+    def test_mysql(self):
+        command, environment = backup.dumpCommand(
+            "mysql://mike:secret@db/app", "app.sql")
+        self.assertEqual(command, ["mysqldump", "--single-transaction", "--quick",
+                                   "--routines", "--result-file=app.sql",
+                                   "-h", "db", "-u", "mike", "app"])
+        self.assertEqual(environment["MYSQL_PWD"], "secret")
+        [(recreate, environment, inputPath),
+         (command, environment, inputPath)] = backup.restoreCommands(
+            "mysql://db/app", "app.sql")
+        self.assertEqual(recreate, ["mysql", "--batch", "-h", "db",
+                                    "--execute=DROP DATABASE IF EXISTS `app`;"
+                                    " CREATE DATABASE `app`"])
+        self.assertEqual(command, ["mysql", "--batch", "-h", "db", "app"])
+        self.assertEqual(inputPath, "app.sql")
+
+    def test_sqlite(self):
+        command, environment = backup.dumpCommand("sqlite:///app.db",
+                                                  'a "b".backup')
+        self.assertEqual(command, ["sqlite3", "app.db",
+                                   '.backup "a \\"b\\".backup"'])
+        self.assertTrue(backup.defaultBackupPath("sqlite:///app.db").startswith(
+                "app.db."))
+        self.assertRaises(ValueError, backup.defaultBackupPath, "sqlite://")
+
+
+class TestEvents(unittest.TestCase):
+    def test_labelText(self):
+        self.assertEqual(events.labelText({"b": 'say "hi"\n', "a": 1}),
+                         '{a="1",b="say \\"hi\\"\\n"}')
+        self.assertEqual(events.labelText({}), "")
+
+    def test_eventStreamFields(self):
+        out = StringIO.StringIO()
+        stream = events.EventStream(out, lambda name: 10, host="db1")
+        stream.beforeRun([(1, "a.sql")])
+        stream.afterMigration("a.sql", 1, 0.5, 3)
+        stream.afterRun(0.6, ValueError("oops"))
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([line["host"] for line in lines], ["db1"] * 3)
+        self.assertEqual(lines[1]["bytes"], 10)
+        self.assertEqual(lines[2]["error"], "ValueError: oops")
+        self.assertEqual(lines[2]["applied"], 1)
+
+
+class TestProfiling(unittest.TestCase):
+    def test_profiledMigrationsRunOneAtATime(self):
+        from goose import scheduler
+        migrator = core.DatabaseMigrator(os.path.join(
+                core.ROOT, "testmigrations", "index.yaml"))
+        migrator.dsn = "postgresql://db/app"
+        migrator.jobs = 4
+        migrator.verbose = False
+        migrator.profiler = object()
+        applied = []
+        migrator.runMigration = lambda name, version: applied.append(name)
+        Scheduler = scheduler.Scheduler
+        scheduler.Scheduler = None
+        try:
+            migrator.applyMigrations([(1, "create.sql"), (2, "track.sql")])
+        finally:
+            scheduler.Scheduler = Scheduler
+        self.assertEqual(applied, ["create.sql", "track.sql"])
+
+    def test_formatBytes(self):
+        self.assertEqual(profiling.formatBytes(512), "+512.0B")
+        self.assertEqual(profiling.formatBytes(3 * 1024 * 1024), "+3.0MB")
+        self.assertEqual(profiling.formatBytes(-2048), "-2.0KB")
@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from goose import indexfile
+
+
+class TestIndexFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cacheDirectory = os.path.join(self.directory, "cache")
+        self.oldCacheDirectory = os.environ.get("GOOSE_CACHE_DIR")
+        os.environ["GOOSE_CACHE_DIR"] = self.cacheDirectory
+        self.indexFilepath = os.path.join(self.directory, "index.yaml")
+        self.writeIndex(["a.sql", "b.sql"])
+        self.parseIndex = indexfile.parseIndex
+
+    def tearDown(self):
+        indexfile.parseIndex = self.parseIndex
+        if self.oldCacheDirectory is None:
+            del os.environ["GOOSE_CACHE_DIR"]
+        else:
+            os.environ["GOOSE_CACHE_DIR"] = self.oldCacheDirectory
+        shutil.rmtree(self.directory)
+
+    def writeIndex(self, migrations):
+        with open(self.indexFilepath, "w") as f:
+            f.write("migrations:\n")
+            for migration in migrations:
+                f.write(" - %s\n"%(migration,))
+
+    def failToParse(self, path):
+        self.fail("index was parsed instead of read from the cache")
+
+    def test_cache(self):
+        index = indexfile.loadIndex(self.indexFilepath)
+        self.assertEqual(index, {"migrations": ["a.sql", "b.sql"]})
+        self.assertTrue(os.path.exists(indexfile.cachePath(self.indexFilepath)))
+        indexfile.parseIndex = self.failToParse
+        self.assertEqual(indexfile.loadIndex(self.indexFilepath), index)
+
+    def test_changedIndexIsParsedAgain(self):
+        indexfile.loadIndex(self.indexFilepath)
+        self.writeIndex(["a.sql", "b.sql", "c.sql"])
+        self.assertEqual(indexfile.loadIndex(self.indexFilepath)["migrations"],
+                         ["a.sql", "b.sql", "c.sql"])
+
+    def test_unwritableCache(self):
+        open(self.cacheDirectory, "w").close()
+        self.assertEqual(indexfile.loadIndex(self.indexFilepath)["migrations"],
+                         ["a.sql", "b.sql"])
+
+    def test_pruneCache(self):
+        for i in range(5):
+            path = os.path.join(self.directory, "index%s.yaml"%(i,))
+            with open(path, "w") as f:
+                f.write("migrations: [a.sql]\n")
+            indexfile.loadIndex(path)
+            os.utime(indexfile.cachePath(path), (i, i))
+        indexfile.pruneCache(self.cacheDirectory, keep=2)
+        self.assertEqual(sorted(os.listdir(self.cacheDirectory)), sorted(
+                os.path.basename(indexfile.cachePath(os.path.join(
+                            self.directory, "index%s.yaml"%(i,))))
+                for i in (3, 4)))
+
+    def test_missingFiles(self):
+        os.mkdir(os.path.join(self.directory, "sub"))
+        for name in ("a.sql", os.path.join("sub", "c.sql")):
+            open(os.path.join(self.directory, name), "w").close()
+        self.assertEqual(indexfile.missingFiles(
+                self.directory, ["a.sql", "b.sql", "sub/c.sql", "sub/d.sql",
+                                 "nowhere/e.sql"]),
+                         ["b.sql", "sub/d.sql", "nowhere/e.sql"])
+
+    def test_missingFilesInCurrentDirectory(self):
+        open(os.path.join(self.directory, "a.sql"), "w").close()
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            self.assertEqual(indexfile.missingFiles("", ["a.sql", "b.sql"]),
+                             ["b.sql"])
+        finally:
+            os.chdir(cwd)
+
+    def test_migrationEntries(self):
+        names, dependencies = indexfile.migrationEntries(
+            ["a.sql", "b.sql",
+             {"name": "c.sql", "depends": "a.sql"},
+             {"name": "d.sql", "depends": []},
+             {"name": "e.sql"}])
+        self.assertEqual(names, ["a.sql", "b.sql", "c.sql", "d.sql", "e.sql"])
+        self.assertEqual(dependencies, {"a.sql": [],
+                                        "b.sql": ["a.sql"],
+                                        "c.sql": ["a.sql"],
+                                        "d.sql": [],
+                                        "e.sql": ["d.sql"]})
+
+    def test_dependenciesMustComeFirst(self):
+        self.assertRaises(ValueError, indexfile.migrationEntries,
+                          [{"name": "a.sql", "depends": ["b.sql"]}, "b.sql"])
+        self.assertRaises(ValueError, indexfile.migrationEntries,
+                          [{"depends": []}])
+
+
+class TestMigrationList(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.oldCacheDirectory = os.environ.get("GOOSE_CACHE_DIR")
+        os.environ["GOOSE_CACHE_DIR"] = os.path.join(self.directory, "cache")
+        os.mkdir(os.path.join(self.directory, "releases"))
+        self.writeIndex("releases/1.yaml", ["a.sql", "b.sql"])
+        self.writeIndex("releases/2.yaml", ["c.sql", {"name": "d.sql",
+                                                      "depends": "a.sql"}])
+        self.index = {"includes": [{"index": "releases/1.yaml", "count": 2},
+                                   {"index": "releases/2.yaml", "count": 2}],
+                      "migrations": ["e.sql"]}
+        self.checked = []
+
+    def tearDown(self):
+        if self.oldCacheDirectory is None:
+            del os.environ["GOOSE_CACHE_DIR"]
+        else:
+            os.environ["GOOSE_CACHE_DIR"] = self.oldCacheDirectory
+        shutil.rmtree(self.directory)
+
+    def writeIndex(self, name, migrations):
+        with open(os.path.join(self.directory, name), "w") as f:
+            f.write("migrations:\n")
+            for migration in migrations:
+                if isinstance(migration, dict):
+                    f.write(" - {name: %(name)s, depends: %(depends)s}\n"%migration)
+                else:
+                    f.write(" - %s\n"%(migration,))
+
+    def migrationList(self):
+        return indexfile.MigrationList(self.directory, self.index,
+                                       check=lambda start, names:
+                                           self.checked.append((start, names)))
+
+    def test_includesAreReadWhenNeeded(self):
+        migrations = self.migrationList()
+        self.assertEqual(len(migrations), 5)
+        self.assertEqual(migrations[-1], "e.sql")
+        self.assertEqual(migrations.loaded(), [])
+        self.assertEqual(migrations[2], "c.sql")
+        self.assertEqual(migrations.loaded(), ["releases/2.yaml"])
+        self.assertEqual(self.checked, [(2, ["c.sql", "d.sql"])])
+        self.assertEqual(list(migrations),
+                         ["a.sql", "b.sql", "c.sql", "d.sql", "e.sql"])
+        self.assertEqual(migrations[1:3], ["b.sql", "c.sql"])
+
+    def test_dependenciesAcrossIncludes(self):
+        migrations = self.migrationList()
+        migrations[4]
+        migrations[2]
+        migrations[0]
+        self.assertEqual(migrations.dependencies, {"a.sql": [],
+                                                   "b.sql": ["a.sql"],
+                                                   "c.sql": ["b.sql"],
+                                                   "d.sql": ["a.sql"],
+                                                   "e.sql": ["d.sql"]})
+
+    def test_appliedIncludesAreSkipped(self):
+        # never read, so it doesn't matter that it's gone
+        os.remove(os.path.join(self.directory, "releases", "1.yaml"))
+        migrations = self.migrationList()
+        self.assertEqual(list(migrations.versionsToCheck({1: "a.sql", 2: "b.sql",
+                                                          3: "c.sql"})),
+                         [(3, "c.sql"), (4, "d.sql"), (5, "e.sql")])
+        self.assertEqual(migrations.loaded(), ["releases/2.yaml"])
+
+    def test_wrongCount(self):
+        self.index["includes"][0]["count"] = 3
+        migrations = self.migrationList()
+        self.assertRaises(ValueError, migrations.__getitem__, 0)
+
+    def test_badInclude(self):
+        self.index["includes"].append({"index": "releases/3.yaml"})
+        self.assertRaises(ValueError, indexfile.MigrationList,
+                          self.directory, self.index)
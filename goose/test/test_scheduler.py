@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+
+from goose import indexfile
+from goose import scheduler
+
+
+class FakeMigrator(object):
+    """Records when each migration ran instead of running it."""
+    def __init__(self, entries, fail=()):
+        self.migrations, self.dependencies = indexfile.migrationEntries(entries)
+        self.dsn = "postgresql://localhost/fake"
+        self.verbose = False
+        self.transactionMode = "migration"
+        self.fail = fail
+        self.ran = {}
+        self.lock = threading.Lock()
+
+    def connect(self, dsn):
+        pass
+
+    def close(self):
+        pass
+
+    def runMigration(self, migrationName, version):
+        start = time.time()
+        time.sleep(0.05)
+        if migrationName in self.fail:
+            raise ValueError(migrationName)
+        with self.lock:
+            self.ran[migrationName] = (start, time.time())
+
+    def pending(self):
+        return list(enumerate(self.migrations, 1))
+
+
+class TestScheduler(unittest.TestCase):
+    entries = ["a.sql",
+               {"name": "b.sql", "depends": []},
+               {"name": "c.sql", "depends": ["a.sql"]},
+               {"name": "d.sql", "depends": ["b.sql"]},
+               {"name": "e.sql", "depends": ["c.sql", "d.sql"]}]
+
+    def test_dependenciesRunFirst(self):
+        migrator = FakeMigrator(self.entries)
+        applied = scheduler.Scheduler(migrator, 4).run(migrator.pending())
+        self.assertEqual(sorted(applied), ["a.sql", "b.sql", "c.sql",
+                                           "d.sql", "e.sql"])
+        ran = migrator.ran
+        for name, depends in migrator.dependencies.items():
+            for dependency in depends:
+                self.assertTrue(ran[dependency][1] <= ran[name][0],
+                                "%s ran before %s"%(name, dependency))
+
+    def test_independentMigrationsOverlap(self):
+        migrator = FakeMigrator(self.entries)
+        scheduler.Scheduler(migrator, 4).run(migrator.pending())
+        c, d = migrator.ran["c.sql"], migrator.ran["d.sql"]
+        self.assertTrue(c[0] < d[1] and d[0] < c[1])
+
+    def test_failureStopsDependents(self):
+        migrator = FakeMigrator(self.entries, fail=["c.sql"])
+        self.assertRaises(ValueError, scheduler.Scheduler(migrator, 4).run,
+                          migrator.pending())
+        self.assertTrue("e.sql" not in migrator.ran)
+        self.assertTrue("a.sql" in migrator.ran)
+
+    def test_appliedDependenciesAreSatisfied(self):
+        migrator = FakeMigrator(self.entries)
+        applied = scheduler.Scheduler(migrator, 4).run(
+            [(3, "c.sql"), (5, "e.sql")])
+        self.assertEqual(applied, ["c.sql", "e.sql"])
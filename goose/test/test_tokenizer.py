@@ -0,0 +1,118 @@
+import StringIO
+import unittest
+
+from goose import tokenizer
+
+
+SCRIPT = """-- leading comment
+CREATE TABLE quotes (id INT, body VARCHAR(32));
+INSERT INTO quotes VALUES (1, 'semi;colon -- not a comment');
+INSERT INTO quotes VALUES (2, 'it''s');
+/* block; comment */ SELECT "odd;name" FROM quotes;
+CREATE FUNCTION f() RETURNS INT AS $body$ BEGIN RETURN 1; END; $body$ LANGUAGE plpgsql;
+DELIMITER $$
+CREATE PROCEDURE p() BEGIN SELECT 1; SELECT 2; END$$
+DELIMITER ;
+select 3
+"""
+
+
+def split(sql, **kwargs):
+    return list(tokenizer.iterStatements(sql, **kwargs))
+
+
+class TestIterStatements(unittest.TestCase):
+    def test_script(self):
+        self.assertEqual(split(SCRIPT), [
+            "CREATE TABLE quotes (id INT, body VARCHAR(32))",
+            "\nINSERT INTO quotes VALUES (1, 'semi;colon -- not a comment')",
+            "\nINSERT INTO quotes VALUES (2, 'it''s')",
+            '\n/* block; comment */ SELECT "odd;name" FROM quotes',
+            "\nCREATE FUNCTION f() RETURNS INT AS $body$ BEGIN RETURN 1; END; $body$ LANGUAGE plpgsql",
+            "\nCREATE PROCEDURE p() BEGIN SELECT 1; SELECT 2; END",
+            "\nselect 3",
+        ])
+
+    def test_chunkBoundaries(self):
+        """Splitting doesn't depend on where the chunks of a file end"""
+        for script in (SCRIPT, "SELECT 1;\n/*!40101 SET NAMES utf8 */;\nSELECT 2;"):
+            expected = split(script)
+            for chunkSize in (1, 2, 3, 7):
+                self.assertEqual(split(script, chunkSize=chunkSize), expected)
+                self.assertEqual(split(StringIO.StringIO(script),
+                                       chunkSize=chunkSize), expected)
+
+    def test_offsets(self):
+        statements = split(SCRIPT, chunkSize=5)
+        for statement in statements:
+            self.assertEqual(SCRIPT[statement.offset:].startswith(
+                    statement.lstrip()), True)
+
+    def test_dollarInIdentifier(self):
+        self.assertEqual(split("SELECT a$b$ FROM t; SELECT 2;"),
+                         ["SELECT a$b$ FROM t", "SELECT 2"])
+
+    def test_commentOnlyStatementsAreSkipped(self):
+        self.assertEqual(split("SELECT 1;\n/* trailing */\n-- done\n"),
+                         ["SELECT 1"])
+
+    def test_mysqlConditionalComment(self):
+        self.assertEqual(split("/*!40101 SET NAMES utf8 */;"),
+                         ["/*!40101 SET NAMES utf8 */"])
+
+    def test_unterminatedQuote(self):
+        self.assertEqual(split("SELECT 'abc;"), ["SELECT 'abc;"])
+
+
+class TestDirectives(unittest.TestCase):
+    def test_chunkDirective(self):
+        statements = split("CREATE TABLE t (id INT);\n"
+                           "-- goose:chunk key=id size=500 sleep=0.1\n"
+                           "UPDATE t SET id = id;\n"
+                           "DELETE FROM t;\n")
+        self.assertEqual([s.directives for s in statements],
+                         [{}, {"chunk": {"key": "id", "size": "500",
+                                         "sleep": "0.1"}}, {}])
+
+    def test_ordinaryComments(self):
+        statements = split("-- goose is great\nSELECT 1;\n"
+                           "-- goose:chunk key=id\n-- more\nSELECT 2;\n")
+        self.assertEqual(statements[0].directives, {})
+        self.assertEqual(statements[1].directives, {"chunk": {"key": "id"}})
+
+    def test_directiveSplitAcrossChunks(self):
+        script = "-- goose:chunk key=id size=7\nUPDATE t SET x = 1;\n"
+        for size in (1, 5, 16, 23):
+            splitter = tokenizer.StatementSplitter()
+            statements = []
+            for start in xrange(0, len(script), size):
+                statements.extend(splitter.feed(script[start:start + size]))
+            statements.extend(splitter.close())
+            self.assertEqual(statements[0].directives,
+                             {"chunk": {"key": "id", "size": "7"}}, size)
+
+    def test_parseDirective(self):
+        self.assertEqual(tokenizer.parseDirective(" goose:chunk key=id"),
+                         ("chunk", {"key": "id"}))
+        self.assertEqual(tokenizer.parseDirective(" a comment"), None)
+
+
+class TestBoundedMemory(unittest.TestCase):
+    def highWater(self, statements, chunkSize=4096):
+        script = "".join("INSERT INTO t VALUES (%d, 'row;%d');\n" % (i, i)
+                         for i in xrange(statements))
+        splitter = tokenizer.StatementSplitter()
+        source = StringIO.StringIO(script)
+        count = 0
+        for chunk in iter(lambda: source.read(chunkSize), ""):
+            count += len(splitter.feed(chunk))
+        count += len(splitter.close())
+        self.assertEqual(count, statements)
+        return splitter.highWater
+
+    def test_independentOfScriptSize(self):
+        # a chunk plus the longest statement (~40 bytes) is the most that
+        # should ever be held, however many statements follow
+        for statements in (1000, 100000):
+            highWater = self.highWater(statements)
+            self.assertTrue(highWater <= 4096 + 64, highWater)
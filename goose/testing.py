@@ -0,0 +1,185 @@
+"""testing.py
+
+Gives test suites freshly migrated databases without replaying every
+migration for every test.
+
+A `TemplateDatabase` migrates one database, the template, once and
+then clones it for each test that needs a database::
+
+  template = testing.TemplateDatabase("migrations/",
+                                      "sqlite:////tmp/app_template.db")
+
+  @pytest.fixture
+  def dsn():
+      with template.cloned() as dsn:
+          yield dsn
+
+SQLite clones are copies of the template's file.  PostgreSQL clones
+are made by the server with ``CREATE DATABASE ... TEMPLATE``, which
+copies the template's files rather than replaying any SQL; PostgreSQL
+refuses to do that while anything is connected to the template, so
+goose disposes of its own engine for it once it's been migrated.
+
+The template is kept between runs and only the migrations it doesn't
+have yet are applied.  If the migrations it has no longer match the
+index it's dropped and built again.
+
+"""
+import contextlib
+import copy
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+
+import sqlalchemy
+from sqlalchemy.engine.url import make_url
+
+from goose import core
+from goose import models
+from goose import render
+
+
+def quoteIdentifier(name):
+    return '"%s"'%(name.replace('"', '""'),)
+
+
+class TemplateDatabase(object):
+    """
+    A migrated database, ``dsn``, to clone test databases from.
+    ``dsn`` must be a SQLite file or a PostgreSQL database; the
+    PostgreSQL user needs to be allowed to create databases.
+    """
+    def __init__(self, migrationDirectory, dsn, toVersion=None):
+        self.dialect = render.dialectName(dsn)
+        if self.dialect not in ("sqlite", "postgresql"):
+            raise ValueError("Can't clone %s databases, only sqlite and"
+                             " postgresql ones"%(self.dialect,))
+        if models.isInMemory(dsn):
+            raise ValueError("The template has to be a sqlite database file")
+        self.migrationDirectory = migrationDirectory
+        self.dsn = dsn
+        self.url = make_url(dsn)
+        self.toVersion = toVersion
+        self.prepared = False
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+        # where sqlite clones go, see clone
+        self.directory = None
+
+    def urlFor(self, database):
+        url = copy.copy(self.url)
+        url.database = database
+        return url
+
+    def serverEngine(self):
+        """An engine on the PostgreSQL server's maintenance database."""
+        return models.engines.engine(str(self.urlFor("postgres")))
+
+    def exists(self):
+        if self.dialect == "sqlite":
+            return os.path.exists(self.url.database)
+        found = self.serverEngine().execute(
+            sqlalchemy.text("SELECT 1 FROM pg_database WHERE datname = :name"),
+            name=self.url.database).scalar()
+        return found is not None
+
+    def create(self):
+        if self.dialect == "postgresql":
+            models.executeOutsideTransaction(self.serverEngine(),
+                "CREATE DATABASE %s"%(quoteIdentifier(self.url.database),))
+
+    def destroy(self):
+        models.engines.dispose(self.dsn)
+        if self.dialect == "sqlite":
+            os.remove(self.url.database)
+        else:
+            models.executeOutsideTransaction(self.serverEngine(),
+                "DROP DATABASE %s"%(quoteIdentifier(self.url.database),))
+
+    def migrator(self):
+        migrator = core.getMigrator(self.migrationDirectory)
+        migrator.verbose = False
+        migrator.connect(self.dsn)
+        models.init(migrator.engine)
+        return migrator
+
+    def release(self, migrator):
+        migrator.close()
+        models.engines.dispose(self.dsn)
+
+    def matchesIndex(self):
+        migrator = self.migrator()
+        try:
+            return migrator.plan().isConsistent()
+        finally:
+            self.release(migrator)
+
+    def prepare(self):
+        """
+        Brings the template up to date, the first time it's called, and
+        returns the names of the migrations that applied.
+        """
+        with self.lock:
+            if self.prepared:
+                return []
+            if not self.exists():
+                self.create()
+            elif not self.matchesIndex():
+                self.destroy()
+                self.create()
+            migrator = self.migrator()
+            try:
+                applied = migrator.migrate(toVersion=self.toVersion)
+            finally:
+                self.release(migrator)
+            self.prepared = True
+        return applied
+
+    def clone(self):
+        """Makes a new copy of the template and returns its DSN.
+        """
+        self.prepare()
+        with self.lock:
+            number = next(self.counter)
+        name = "%s_clone_%s_%s"%(
+            os.path.splitext(os.path.basename(self.url.database))[0],
+            os.getpid(), number)
+        if self.dialect == "sqlite":
+            with self.lock:
+                if self.directory is None:
+                    self.directory = tempfile.mkdtemp(prefix="goose-clones-")
+            path = os.path.join(self.directory, name + ".db")
+            shutil.copyfile(self.url.database, path)
+            return "sqlite:///%s"%(path,)
+        models.executeOutsideTransaction(self.serverEngine(),
+            "CREATE DATABASE %s TEMPLATE %s"%(quoteIdentifier(name),
+                                              quoteIdentifier(self.url.database)))
+        return str(self.urlFor(name))
+
+    def drop(self, dsn):
+        """Drops a clone made by `clone`."""
+        models.engines.dispose(dsn)
+        url = make_url(dsn)
+        if self.dialect == "sqlite":
+            if os.path.exists(url.database):
+                os.remove(url.database)
+        else:
+            models.executeOutsideTransaction(self.serverEngine(),
+                "DROP DATABASE IF EXISTS %s"%(quoteIdentifier(url.database),))
+
+    @contextlib.contextmanager
+    def cloned(self):
+        """A clone's DSN for the duration of a with block."""
+        dsn = self.clone()
+        try:
+            yield dsn
+        finally:
+            self.drop(dsn)
+
+    def cleanup(self):
+        """Removes the directory sqlite clones are made in."""
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -0,0 +1,337 @@
+"""tokenizer.py
+
+Splits SQL scripts into individual statements in a single pass.
+
+The splitter understands single quoted strings, double quoted and
+backtick quoted identifiers, -- line comments, /* block */ comments,
+PostgreSQL dollar quoting ($$ ... $$ or $tag$ ... $tag$) and the MySQL
+client's DELIMITER directive.  Line comments of the form
+
+  -- goose:chunk key=id size=10000
+
+are goose directives; their options are attached to the statement
+that follows them (see `Statement.directives`).  Text can be fed in arbitrary chunks and
+every statement is handed back as soon as its delimiter has been seen,
+so callers can start executing a script while the rest of it is still
+being read.
+
+"""
+import re
+
+
+DEFAULT_DELIMITER = ";"
+CHUNK_SIZE = 64 * 1024
+
+# --, /* and the closing tokens they wait for.
+COMMENTS = {"--": "\n", "/*": "*/"}
+QUOTES = {"'": "'", '"': '"', "`": "`"}
+
+DOLLAR_QUOTE = r"\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$"
+DIRECTIVE = re.compile(r"(?i)delimiter[ \t]+(\S+)[^\n]*")
+GOOSE_DIRECTIVE = re.compile(r"[ \t]*goose:(\w+)([^\n]*)")
+OPTION = re.compile(r"(\w+)=(\S+)")
+NON_SPACE = re.compile(r"\S")
+WORD_CHARACTER = re.compile(r"\w")
+
+
+class Statement(str):
+    """A single statement from a script.
+
+    ``offset`` is the position in the script of the first character
+    of the statement (leading whitespace and comments excluded).
+    ``directives`` maps the name of each ``-- goose:name key=value``
+    comment before the statement to a dict of its options.
+    """
+    def __new__(cls, text, offset=0, directives=None):
+        statement = str.__new__(cls, text)
+        statement.offset = offset
+        statement.directives = directives or {}
+        return statement
+
+
+def parseDirective(text):
+    """``goose:chunk key=id size=10`` -> ("chunk", {"key": "id", "size": "10"})
+    """
+    match = GOOSE_DIRECTIVE.match(text)
+    if match is None:
+        return None
+    return match.group(1), dict(OPTION.findall(match.group(2)))
+
+
+def tokenPattern(delimiter):
+    """Regex matching anything that can end a statement or open a quote.
+    """
+    alternatives = [re.escape(delimiter), "'", '"', "`", "--", r"/\*"]
+    # A custom delimiter like $$ wins over dollar quoting, which is
+    # how the mysql client would read the script as well.
+    if "$" not in delimiter:
+        alternatives.append(DOLLAR_QUOTE)
+    return re.compile("|".join(alternatives))
+
+
+def textPattern(delimiter):
+    """Regex matching a run of statement text that needs no attention.
+
+    Complete quoted strings are matched whole so the bulk of a script
+    is skipped over by the regex engine instead of token by token.
+    Characters that might start a token are only matched once enough
+    text follows them to be sure they don't, which keeps tokens that
+    straddle two chunks out of the match.
+    """
+    # characters that may start a token, mapped to what has to follow
+    # them for that to actually be the case
+    special = {"-": ["-"], "/": ["*"]}
+    special.setdefault(delimiter[0], []).append(delimiter[1:])
+    excluded = "".join(re.escape(c) for c in special)
+    alternatives = []
+    if "$" not in delimiter:
+        excluded += r"\$"
+        alternatives += [r"(?<=\w)\$",
+                         r"\$(?=[^A-Za-z_$]|[A-Za-z_]\w*[^\w$])"]
+    alternatives += ["[^%s'\"`]+" % (excluded,),
+                     "'[^']*'", '"[^"]*"', "`[^`]*`"]
+    for character, following in special.items():
+        if "" in following:
+            continue
+        alternatives.append("%s(?!%s)(?=[\\s\\S]{%d})" % (
+                re.escape(character),
+                "|".join(re.escape(f) for f in following),
+                max(len(f) for f in following)))
+    return re.compile("(?:%s)*" % ("|".join(alternatives),))
+
+
+class StatementSplitter(object):
+    """Incremental statement splitter.
+
+    Call ``feed`` with successive pieces of a script and ``close`` once
+    the script is exhausted; both return the list of statements that
+    were completed by that call.
+
+    The splitter only holds on to the statement in progress and the
+    unscanned end of the last chunk.  ``highWater`` records the most
+    text it has held at once, which is bounded by the longest statement
+    plus the chunk size no matter how long the script is.
+    """
+
+    def __init__(self, delimiter=DEFAULT_DELIMITER):
+        self.setDelimiter(delimiter)
+        self._buffer = ""
+        self._offset = 0     # position of _buffer[0] in the script
+        self._previous = ""  # last character before _buffer
+        self._parts = []
+        self._held = 0       # total length of _parts
+        self._start = None   # offset of the current statement
+        self._hasCode = False
+        self._seenContent = False
+        self._close = None   # token that ends the current quote/comment
+        self._keep = True    # whether quoted text belongs to the statement
+        self._code = True    # whether quoted text counts as code
+        self._directives = {}
+        self.highWater = 0
+
+    def setDelimiter(self, delimiter):
+        self.delimiter = delimiter
+        self._pattern = tokenPattern(delimiter)
+        self._text = textPattern(delimiter)
+
+    def feed(self, text):
+        if text:
+            self._buffer += text
+        return self._scan(final=False)
+
+    def close(self):
+        return self._scan(final=True)
+
+    def _take(self, start, end, code=True):
+        """Move ``_buffer[start:end]`` into the current statement.
+        """
+        if start >= end:
+            return
+        piece = self._buffer[start:end]
+        self._parts.append(piece)
+        self._held += end - start
+        if self._start is None or (code and not self._hasCode):
+            match = NON_SPACE.search(piece)
+            if match is None:
+                return
+            if self._start is None:
+                self._start = self._offset + start + match.start()
+            if code:
+                self._hasCode = True
+
+    def _finishStatement(self, statements):
+        text = "".join(self._parts)
+        offset = self._start
+        hasCode = self._hasCode
+        directives = self._directives
+        self._parts = []
+        self._held = 0
+        self._start = None
+        self._hasCode = False
+        if not hasCode:
+            return
+        self._directives = {}
+        body = text.strip()
+        # Statements keep a single leading newline when they started on a
+        # new line, except for the very first thing in the script.
+        if self._seenContent and text.find("\n", 0, text.find(body[0])) != -1:
+            body = "\n" + body
+        self._seenContent = True
+        statements.append(Statement(body, offset, directives))
+
+    def _directive(self, position, final):
+        """Handle a DELIMITER line at the start of a statement.
+
+        Returns the position after the directive, ``None`` if there is no
+        directive at ``position`` and ``-1`` if more text is needed to tell.
+        """
+        buffer = self._buffer
+        match = NON_SPACE.search(buffer, position)
+        if match is None:
+            return None if final else -1
+        start = match.start()
+        if buffer[start] not in "dD":
+            return None
+        head = buffer[start:start + 10].lower()
+        if not "delimiter ".startswith(head) and not head.startswith("delimiter"):
+            return None
+        end = buffer.find("\n", start)
+        if end == -1:
+            if not final:
+                return -1
+            end = len(buffer)
+        match = DIRECTIVE.match(buffer, start, end)
+        if match is None:
+            return None
+        self._parts = []
+        self._held = 0
+        self._start = None
+        self._seenContent = True
+        self.setDelimiter(match.group(1))
+        return end
+
+    def _scan(self, final):
+        buffer = self._buffer
+        size = len(buffer)
+        statements = []
+        position = 0
+        while position < size or (final and self._parts):
+            if self._close is not None:
+                end = buffer.find(self._close, position)
+                if end == -1:
+                    cut = size
+                    if not final:
+                        cut = max(position, size - len(self._close) + 1)
+                    else:
+                        self._close = None
+                    if self._keep:
+                        self._take(position, cut, self._code)
+                    position = cut
+                    if not final:
+                        break
+                    continue
+                if self._close == "\n":
+                    # the newline ending a line comment stays in the text
+                    position = end
+                else:
+                    end += len(self._close)
+                    self._take(position, end, self._code)
+                    position = end
+                self._close = None
+                continue
+
+            if self._start is None:
+                end = self._directive(position, final)
+                if end == -1:
+                    break
+                if end is not None:
+                    position = end
+                    continue
+
+            skipped = self._text.match(buffer, position).end()
+            match = self._pattern.search(buffer, skipped)
+            if match is None:
+                # whatever follows the skipped text might be the start of
+                # a token that the next chunk completes
+                cut = size if final else skipped
+                self._take(position, cut)
+                position = cut
+                if final:
+                    self._finishStatement(statements)
+                break
+
+            token = match.group()
+            start = match.start()
+            if token == self.delimiter:
+                self._take(position, start)
+                self._finishStatement(statements)
+                position = match.end()
+            elif token in QUOTES:
+                self._take(position, match.end())
+                self._close, self._keep, self._code = QUOTES[token], True, True
+                position = match.end()
+            elif token == "--":
+                self._take(position, start)
+                end = match.end()
+                lineEnd = buffer.find("\n", end)
+                if lineEnd == -1 and not final:
+                    # wait for the rest of what may be a directive
+                    position = start
+                    break
+                directive = parseDirective(buffer[end:lineEnd if lineEnd != -1
+                                                  else size])
+                if directive is not None:
+                    self._directives[directive[0]] = directive[1]
+                self._close, self._keep, self._code = COMMENTS[token], False, False
+                position = end
+            elif token == "/*":
+                if match.end() == size and not final:
+                    # wait to see whether it's a /*! ... */
+                    self._take(position, start)
+                    position = start
+                    break
+                # Block comments are sent along with the statement since
+                # MySQL treats /*! ... */ as executable code.
+                code = buffer.startswith("/*!", start)
+                self._take(position, start)
+                self._take(start, match.end(), code)
+                self._close, self._keep, self._code = COMMENTS[token], True, code
+                position = match.end()
+            else:
+                previous = buffer[start - 1] if start else self._previous
+                if previous and WORD_CHARACTER.match(previous):
+                    # part of an identifier like foo$bar$, not a quote
+                    self._take(position, start + 1)
+                    position = start + 1
+                    continue
+                self._take(position, match.end())
+                self._close, self._keep, self._code = token, True, True
+                position = match.end()
+
+        self.highWater = max(self.highWater, size + self._held)
+        if position:
+            self._previous = buffer[position - 1]
+        self._offset += position
+        self._buffer = buffer[position:]
+        if final:
+            self._buffer = ""
+        return statements
+
+
+def iterStatements(source, delimiter=DEFAULT_DELIMITER, chunkSize=CHUNK_SIZE):
+    """Yield each `Statement` in ``source``.
+
+    ``source`` may be a string or a file-like object, which is read
+    ``chunkSize`` bytes at a time.
+    """
+    splitter = StatementSplitter(delimiter)
+    if hasattr(source, "read"):
+        chunks = iter(lambda: source.read(chunkSize), "")
+    else:
+        chunks = (source[i:i + chunkSize]
+                  for i in xrange(0, len(source), chunkSize))
+    for chunk in chunks:
+        for statement in splitter.feed(chunk):
+            yield statement
+    for statement in splitter.close():
+        yield statement